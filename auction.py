@@ -1,19 +1,98 @@
-from ctoken import xassert
+from array import array
+from ctoken import xassert, memoized
+from events import EventSink
+from ticks import pack_array, unpack_array
 
 
-class Auction(object):
+class Orders(object):
+    """
+    accepted order values by buyer.
+    buyers are mapped to integer ids, the values kept in an array indexed by id
+    """
 
     def __init__(self):
+        self.recipients = []  # id -> recipient
+        self._ids = dict()  # recipient -> id
+        self.values = array('d')
+        self.total = 0
+
+    def __len__(self):
+        return len(self.recipients)
+
+    def add(self, recipient, value):
+        i = self._ids.get(recipient)
+        if i is None:
+            self._ids[recipient] = len(self.recipients)
+            self.recipients.append(recipient)
+            self.values.append(value)
+        else:
+            self.values[i] += value
+        self.total += value
+
+    def index(self, recipient):
+        return self._ids.get(recipient)
+
+    def get(self, recipient, default=0):
+        i = self._ids.get(recipient)
+        return default if i is None else self.values[i]
+
+    def items(self):
+        return zip(self.recipients, self.values)
+
+    def __getstate__(self):
+        "the values as bytes, the ids are rebuilt from the recipients"
+        return dict(recipients=self.recipients, values=pack_array(self.values),
+                    total=self.total)
+
+    def __setstate__(self, state):
+        self.recipients = state['recipients']
+        self._ids = dict((recipient, i) for i, recipient in enumerate(self.recipients))
+        self.values = unpack_array(state['values'])
+        self.total = state['total']
+
+    def shares(self, num, total=None):
+        "num split pro rata to the values, in order of the ids"
+        total = total or self.total
+        try:
+            import numpy as np
+        except ImportError:
+            return [num * value / total for value in self.values]
+        return np.frombuffer(self.values, dtype='d') * num / total
+
+
+class Auction(object):
+
+    _cached_version = None
+
+    def __init__(self, events=None, lazy_claims=False):
+        """
+        lazy_claims: finalize_auction only fixes the issuance, buyers are credited
+        when their balance is accessed or claimed (see Token.defer)
+        """
         self.mint = None  # set by mint
+        self.events = events or EventSink()
+        self.lazy_claims = lazy_claims
 
     def start(self, factor, const):
         self.factor = factor
         self.const = const
         self.elapsed = 0
-        self.value_by_buyer = {}
+        self.orders = Orders()
         self.ended = False
         self.reserve = 0
         self.final_price = 0
+        ev = self.events.auction_start
+        if ev:
+            ev(factor, const)
+
+    @property
+    def version(self):
+        "changes with elapsed, the collected reserve and the state of the mint"
+        return self.elapsed, self.reserve, self.factor, self.const, self.mint.version
+
+    @property
+    def value_by_buyer(self):
+        return dict(self.orders.items())
 
     @property
     def auctioned_supply(self):
@@ -28,7 +107,7 @@ class Auction(object):
     def _total_supply(self):
         return self.mint.token.supply + self.auctioned_supply
 
-    @property
+    @memoized
     def price(self):
         """
         the price all eligible bidders would pay.
@@ -45,7 +124,7 @@ class Auction(object):
 
     avg_price = price
 
-    @property
+    @memoized
     def missing_reserve_to_end_auction(self):
         target = self.mint.curve.reserve(self._total_supply)
         missing = target - self.mint.reserve - self.reserve
@@ -57,8 +136,11 @@ class Auction(object):
 
     def order(self, recipient, value):
         value = min(value, self.missing_reserve_to_end_auction)  # FXIME refund
-        self.value_by_buyer[recipient] = self.value_by_buyer.get(recipient, 0) + value
+        self.orders.add(recipient, value)
         self.reserve += value
+        ev = self.events.auction_order
+        if ev:
+            ev(recipient, value, self.elapsed)
         # print self.reserve, value, self.price
         if self.missing_reserve_to_end_auction == 0:  # this call ended the auction
             self.finalize_auction()
@@ -80,12 +162,13 @@ class Auction(object):
         seniorage = new_issuance * self.mint.beneficiary.fraction
         assert seniorage < new_issuance
         avg_price = self.reserve / (new_issuance - seniorage)
-        print 'finalizing auction at price:{} avg price:{:,.2f}'.format(self.price, avg_price)
 
-        for recipient, value in self.value_by_buyer.items():
-            num_issued = new_issuance * value / self.reserve
-            # print num_issued, value, price
-            self.mint._issue(num_issued, recipient)
+        # pro rata to the value, the seigniorage is credited once
+        if self.lazy_claims:
+            self.mint._issue_deferred(self.orders, new_issuance, self.reserve)
+        else:
+            num_issued = self.orders.shares(new_issuance, self.reserve)
+            self.mint._issue_many(num_issued, self.orders.recipients)
         # transfer reserve
         self.mint.reserve = self.reserve
         xassert(self.mint.curve.reserve(self.mint.token.supply), self.reserve)
@@ -94,19 +177,67 @@ class Auction(object):
 
         xassert(self.mint.token.supply, new_issuance)
         assert self.mint.token.supply > 0
-        print 'supply', self.mint.token.supply
+        ev = self.events.auction_finalized
+        if ev:
+            ev(self.elapsed, self.final_price, avg_price, self.reserve, self.mint.token.supply)
 
-    @property
+    @memoized
     def bid(self):
         s = self._total_supply
         r = self.mint.curve.reserve(s)
         return r / s
 
-    @property
+    @memoized
     def max_mktcap(self):
         return self._total_supply * self.avg_price
 
-    @property
+    @memoized
     def max_valuation(self):
         # return self.max_mktcap * self.mint.beneficiary.fraction
         return self._total_supply * (self.avg_price - self.bid)
+
+    # closed forms for the times at which the auction state crosses a threshold
+
+    def elapsed_at_auctioned_supply(self, auctioned_supply):
+        if auctioned_supply <= 0:
+            return float('inf')
+        return self.factor / auctioned_supply - self.const
+
+    def _max_valuation_at(self, auctioned_supply):
+        total_supply = self.mint.token.supply + auctioned_supply
+        reserve = self.mint.curve.reserve(total_supply)
+        sold_supply = auctioned_supply * (1 - self.mint.beneficiary.fraction)
+        avg_price = (reserve - self.mint.reserve) / sold_supply
+        return total_supply * avg_price - reserve
+
+    def elapsed_at_max_valuation(self, valuation):
+        """
+        the elapsed time at which max_valuation has dropped to valuation
+        max_valuation decreases over time, a bid with a higher valuation is eligible afterwards
+        """
+        mint = self.mint
+        fraction = mint.beneficiary.fraction
+        if not mint.token.supply and fraction:
+            # max_valuation = (fraction * reserve(auctioned_supply) - mint.reserve) / (1 - fraction)
+            reserve = (valuation * (1 - fraction) + mint.reserve) / fraction
+            if reserve <= 0:
+                return 0
+            return self.elapsed_at_auctioned_supply(mint.curve.supply(reserve))
+        # no closed form with existing supply, bisect the auctioned supply
+        hi = self.auctioned_supply
+        if self._max_valuation_at(hi) <= valuation:
+            return self.elapsed
+        lo = 0
+        for i in range(100):
+            mid = (lo + hi) / 2
+            if self._max_valuation_at(mid) <= valuation:
+                lo = mid
+            else:
+                hi = mid
+        return self.elapsed_at_auctioned_supply(lo)
+
+    def elapsed_at_end(self):
+        "the elapsed time at which the collected reserve suffices to end the auction"
+        reserve = self.mint.reserve + self.reserve
+        return self.elapsed_at_auctioned_supply(
+            self.mint.curve.supply(reserve) - self.mint.token.supply)
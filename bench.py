@@ -0,0 +1,377 @@
+"""
+benchmarks for Mint, Auction, Exchange, the trader strategies and the simulations
+
+    python bench.py --save baseline.json
+    ... change the engines ...
+    python bench.py --compare baseline.json
+
+every benchmark is run at several scales, the best of --repeat runs is kept.
+with --compare, benchmarks slower than the baseline by more than --threshold
+are flagged and the exit status is 1.
+"""
+from __future__ import division
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+from ctoken import Token
+from exchange import Exchange, BuyOrder, SellOrder, NotAvailable
+import traders as strategies
+import simulator
+import simple_sim
+import simple_auction
+
+BENCHMARKS = []  # (name, setup, scales)
+
+
+def benchmark(name, scales=(1,)):
+    """
+    registers setup(scale), which prepares the state and returns the function to time
+    """
+    def register(setup):
+        BENCHMARKS.append((name, setup, scales))
+        return setup
+    return register
+
+
+def noop(*args):
+    pass
+
+
+def gen_mint(auction_ended=True):
+    mint = simulator.gen_token()
+    mint.auction.start(factor=10**12, const=10**3)
+    if auction_ended:
+        mint.auction.order('prealloc', mint.auction.missing_reserve_to_end_auction)
+    return mint
+
+
+# Mint
+
+@benchmark('mint.buy', scales=(1000, 10000))
+def bench_mint_buy(n):
+    mint = gen_mint()
+
+    def run():
+        for i in xrange(n):
+            mint.buy(100, i)
+    return run
+
+
+@benchmark('mint.sell', scales=(1000, 10000))
+def bench_mint_sell(n):
+    mint = gen_mint()
+    sold = [mint.buy(100, i) for i in xrange(n)]
+
+    def run():
+        for i, num in enumerate(sold):
+            mint.sell(num / 2, i)
+    return run
+
+
+# Auction
+
+def gen_auction(n):
+    "an auction to be filled with n orders of the total amount in simulator.main"
+    mint = gen_mint(auction_ended=False)
+    return mint.auction, 20 * 10**6 / n
+
+
+@benchmark('auction.order', scales=(1000, 10000, 100000))
+def bench_auction_order(n):
+    auction, value = gen_auction(n)
+
+    def run():
+        for i in xrange(n):
+            auction.order(i, value)
+    return run
+
+
+@benchmark('auction.finalize_auction', scales=(1000, 10000, 100000))
+def bench_auction_finalize(n):
+    auction, value = gen_auction(n)
+    for i in xrange(n):
+        auction.order(i, value)
+    auction.elapsed = auction.elapsed_at_end()
+    return auction.finalize_auction
+
+
+@benchmark('auction.finalize_auction.lazy_claims', scales=(1000, 10000, 100000))
+def bench_auction_finalize_lazy(n):
+    auction, value = gen_auction(n)
+    auction.lazy_claims = True
+    for i in xrange(n):
+        auction.order(i, value)
+    auction.elapsed = auction.elapsed_at_end()
+    return auction.finalize_auction
+
+
+# Exchange
+
+def gen_book(n, buy=False, sell=True):
+    "an exchange with n resting orders per side"
+    ex = Exchange()
+    for i in xrange(n):
+        if sell:
+            ex.place(SellOrder(100 + i % 1000 * 0.1, 10, callback=noop))
+        if buy:
+            ex.place(BuyOrder(99 - i % 1000 * 0.1, 10, callback=noop))
+    return ex
+
+
+@benchmark('exchange.place', scales=(1000, 10000))
+def bench_exchange_place(n):
+    ex = Exchange()
+    orders = [BuyOrder(99 - i % 1000 * 0.1, 10, callback=noop) for i in xrange(n)]
+    orders += [SellOrder(100 + i % 1000 * 0.1, 10, callback=noop) for i in xrange(n)]
+
+    def run():
+        for o in orders:
+            ex.place(o)
+    return run
+
+
+@benchmark('exchange.cancel', scales=(1000, 10000))
+def bench_exchange_cancel(n):
+    ex = gen_book(n)
+    orders = list(ex._asks)
+    random.Random(0).shuffle(orders)
+
+    def run():
+        for o in orders:
+            ex.cancel(o)
+    return run
+
+
+@benchmark('exchange.match', scales=(1000, 10000))
+def bench_exchange_match(n):
+    "one order sweeping the whole other side"
+    ex = gen_book(n)
+    o = BuyOrder(10**6, 10 * n, callback=noop)
+    return lambda: ex.place(o)
+
+
+@benchmark('exchange.buy_market', scales=(1000, 10000))
+def bench_exchange_buy_market(n):
+    ex = gen_book(n)
+    return lambda: ex.buy_market(10 * n)
+
+
+@benchmark('exchange.buy_cost', scales=(1000, 10000))
+def bench_exchange_buy_cost(n):
+    "100 quotes for half the book"
+    ex = gen_book(n)
+
+    def run():
+        for i in xrange(100):
+            ex.buy_cost(5 * n)
+    return run
+
+
+# Strategies
+
+def gen_market(num_traders, strategy_cls):
+    random.seed(42)
+    ex = Exchange()
+    ex.time = 1
+    market_maker = strategies.Trader(ex, 10**6, 10**5, strategies.MarketMaker(100, 1, 0.01))
+    market_maker.trigger()
+    traders = [strategies.Trader(ex, 10**4, 100, strategy_cls()) for i in xrange(num_traders)]
+    return ex, market_maker, traders
+
+
+def trigger(trader):
+    try:
+        trader.trigger()
+    except NotAvailable:
+        pass
+
+
+for strategy_cls in [strategies.BuyAndHold, strategies.AverageIn, strategies.AverageOut,
+                     strategies.TrailingStop, strategies.TrendFollower, strategies.MarketMaker]:
+
+    @benchmark('trader.trigger.' + strategy_cls.__name__, scales=(100, 1000))
+    def bench_trigger(n, strategy_cls=strategy_cls):
+        if strategy_cls is strategies.MarketMaker:
+            ex, market_maker, traders = gen_market(0, strategies.BuyAndHold)
+            traders = [market_maker] * n
+        else:
+            ex, market_maker, traders = gen_market(n, strategy_cls)
+
+        def run():
+            for i in range(10):
+                ex.time += 10
+                for t in traders:
+                    trigger(t)
+        return run
+
+
+# Simulations
+
+@benchmark('scenario.simulator', scales=(100, 300, 1000))
+def bench_simulator(num_bidders):
+    "simulator.main without drawing"
+    random.seed(42)
+    mint = simulator.gen_token()
+    bids = simulator.gen_bids(num_bidders, 20 * 10**6, 5 * 10**6, 0.25 * 5 * 10**6)
+    sim = simulator.Simulation(mint, bids)
+
+    def run():
+        sim.run_auction(factor=10**12, const=10**3)
+        sim.run_trading(mint.auction.elapsed * 3, stddev=0.005, final_price=1.2 * mint.ask)
+    return run
+
+
+@benchmark('scenario.simulator.events', scales=(100, 300, 1000))
+def bench_simulator_events(num_bidders):
+    "simulator.main without drawing, event driven auction"
+    random.seed(42)
+    mint = simulator.gen_token()
+    bids = simulator.gen_bids(num_bidders, 20 * 10**6, 5 * 10**6, 0.25 * 5 * 10**6)
+    sim = simulator.Simulation(mint, bids)
+
+    def run():
+        sim.run_auction_events(factor=10**12, const=10**3)
+        sim.run_trading(mint.auction.elapsed * 3, stddev=0.005, final_price=1.2 * mint.ask)
+    return run
+
+
+@benchmark('scenario.trading_paths', scales=(1, 1000, 10000))
+def bench_trading_paths(num_paths):
+    "the trading of scenario.simulator[300] for num_paths walks"
+    random.seed(42)
+    mint = simulator.gen_token()
+    bids = simulator.gen_bids(300, 20 * 10**6, 5 * 10**6, 0.25 * 5 * 10**6)
+    sim = simulator.Simulation(mint, bids)
+    sim.run_auction(factor=10**12, const=10**3)
+
+    def run():
+        sim.run_trading_paths(mint.auction.elapsed * 3, stddev=0.005,
+                              final_price=1.2 * mint.ask, num_paths=num_paths, seed=42,
+                              every=100)
+    return run
+
+
+@benchmark('scenario.simple_sim', scales=(1000, 3000, 10000))
+def bench_simple_sim(num_bidders):
+    "simple_sim.main without drawing"
+    random.seed(42)
+    bids = simple_sim.gen_bids(num_bidders, 20 * 10**6, 5 * 10**6, 0.25 * 5 * 10**6)
+    token = Token()
+    token.issue(0.25 * simple_auction.Auction.supply, 'prealloc')
+    auction = simple_auction.Auction(token, factor=30 * 10**6, const=10**3)
+    sim = simple_sim.Simulation(auction, bids)
+    return sim.run_auction
+
+
+@benchmark('scenario.traders', scales=(10, 100))
+def bench_traders(num_traders):
+    "traders.test with num_traders"
+    random.seed(42)
+    ex = Exchange()
+    max_tokens = 10000
+    max_amount = 100 * max_tokens
+    market_maker = strategies.Trader(ex, max_amount, max_tokens * num_traders,
+                                     strategies.MarketMaker(100, mu=1, sigma=0.01))
+    traders = [market_maker]
+    for i in range(num_traders):
+        strategy_cls = random.choice([strategies.BuyAndHold, strategies.AverageOut])
+        traders.append(strategies.Trader(ex, random.randint(0, max_amount),
+                                         random.randint(0, max_tokens), strategy_cls()))
+    ex.time = 1
+
+    def run():
+        while ex.time < 3600:
+            ex.time += 10
+            for t in traders:
+                trigger(t)
+    return run
+
+
+# Runner
+
+class Quiet(object):
+    "swallows the prints of the engines while benchmarking"
+
+    def __enter__(self):
+        self.stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+
+    def __exit__(self, *args):
+        sys.stdout.close()
+        sys.stdout = self.stdout
+
+
+def measure(setup, scale, repeat):
+    best = None
+    for i in range(repeat):
+        with Quiet():
+            run = setup(scale)
+            started = time.time()
+            run()
+            elapsed = time.time() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run_benchmarks(pattern='', repeat=3, quick=False):
+    results = dict()
+    for name, setup, scales in BENCHMARKS:
+        if pattern not in name:
+            continue
+        for scale in scales[:1] if quick else scales:
+            key = '{}[{}]'.format(name, scale)
+            results[key] = measure(setup, scale, repeat)
+            print '{:<45} {:>10.4f}s'.format(key, results[key])
+    return results
+
+
+def compare(results, baseline, threshold):
+    "prints the changes against baseline, returns the keys slower than the threshold"
+    slower = []
+    print '{:<45} {:>11} {:>11} {:>8}'.format('', 'baseline', 'current', 'ratio')
+    for key in sorted(results):
+        if key not in baseline:
+            continue
+        ratio = results[key] / baseline[key] if baseline[key] else 1
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = 'SLOWER'
+            slower.append(key)
+        elif ratio < 1 - threshold:
+            flag = 'faster'
+        print '{:<45} {:>10.4f}s {:>10.4f}s {:>7.2f}x {}'.format(
+            key, baseline[key], results[key], ratio, flag)
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--filter', default='', help='run benchmarks containing this string')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--quick', action='store_true', help='smallest scale only')
+    parser.add_argument('--save', help='write the results as json')
+    parser.add_argument('--compare', help='baseline json written by --save')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='relative slowdown which is flagged')
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.filter, args.repeat, args.quick)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(dict(python=platform.python_version(), machine=platform.machine(),
+                           time=time.time(), results=results), f, indent=2, sort_keys=True)
+    if args.compare:
+        print
+        baseline = json.load(open(args.compare))['results']
+        slower = compare(results, baseline, args.threshold)
+        if slower:
+            print '{} benchmarks slower than the baseline'.format(len(slower))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
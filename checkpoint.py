@@ -0,0 +1,137 @@
+"""
+snapshots of a simulation and scenarios forked from them
+
+a snapshot is the zlib compressed pickle of a simulator.Simulation (mint,
+auction, token, bids and ticks) and the state of random, taken after any
+phase. event subscribers are not part of it, see EventSink.__getstate__.
+trading scenarios forked from a snapshot taken at the end of the auction
+skip gen_bids and the auction:
+
+    sim.run_auction_events(factor=10**12, const=10**3)
+    data = snapshot(sim)
+    results = fork(data, [dict(seed=1, trading_stddev=0.01), dict(seed=2, final_price=1.5)])
+"""
+from __future__ import division
+import time
+import zlib
+import random
+import pickle
+import multiprocessing
+import sweep
+
+
+def snapshot(sim, level=6):
+    "the compressed state of sim and random"
+    data = pickle.dumps(dict(sim=sim, random=random.getstate()), pickle.HIGHEST_PROTOCOL)
+    return zlib.compress(data, level)
+
+
+def restore(data, seed=None):
+    """
+    a new Simulation from the snapshot. random continues where the snapshot was
+    taken or is seeded with seed
+    """
+    state = pickle.loads(zlib.decompress(data))
+    if seed is None:
+        random.setstate(state['random'])
+    else:
+        random.seed(seed)
+    return state['sim']
+
+
+def save(sim, path):
+    with open(path, 'wb') as f:
+        f.write(snapshot(sim))
+
+
+def load(path, seed=None):
+    with open(path, 'rb') as f:
+        return restore(f.read(), seed)
+
+
+def run_fork(data, params):
+    """
+    the trading phase for params (trading parameters of sweep.DEFAULTS and seed)
+    from the snapshot, the result is that of sweep.run_scenario
+    """
+    p = dict(sweep.DEFAULTS)
+    p.update(params)
+    started = time.time()
+    sim = restore(data, params.get('seed'))
+    sim.verbose = False
+    result = dict(key=sweep.scenario_key(params), params=params,
+                  auction_elapsed=sim.auction.elapsed)
+    try:
+        sweep.run_trading(sim, p)
+    except Exception as e:
+        result['error'] = sweep.error_message(e)
+    sweep.summarize_run(result, sim)
+    result['runtime'] = time.time() - started
+    return result
+
+
+_data = None  # the snapshot of the worker processes
+
+
+def _init_worker(data):
+    global _data
+    _data = data
+
+
+def _run_worker(params):
+    return run_fork(_data, params)
+
+
+def fork(data, scenarios, processes=1):
+    """
+    run_fork for every scenario, in this process or in a pool of processes
+    (None for all cores) which receive the snapshot once. results are in order
+    """
+    if processes == 1:
+        return [run_fork(data, params) for params in scenarios]
+    pool = multiprocessing.Pool(processes, initializer=_init_worker, initargs=(data,))
+    try:
+        results = pool.map(_run_worker, scenarios)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return results
+
+
+def test():
+    from events import console_writer
+    p = dict(sweep.DEFAULTS, num_bidders=100, seed=3, max_elapsed=1.2)
+    sim = sweep.gen_simulation(p)
+    console_writer().attach(sim.auction.events, 'auction_finalized')  # not pickled
+    sim.run_auction_events(factor=p['auction_factor'], const=p['auction_const'])
+    auction_elapsed = sim.auction.elapsed
+    data = snapshot(sim)
+    assert len(data) < len(pickle.dumps(sim, pickle.HIGHEST_PROTOCOL))
+
+    # restored without a seed, trading continues as in the original
+    copy = restore(data)
+    assert not copy.auction.events.auction_finalized
+    assert len(copy.ticker) == len(sim.ticker) and copy.mint.reserve == sim.mint.reserve
+    sweep.run_trading(copy, p)
+    random.setstate(pickle.loads(zlib.decompress(data))['random'])
+    sweep.run_trading(sim, p)
+    assert sweep.summarize(copy) == sweep.summarize(sim)
+    assert list(copy.ticker['Reserve']) == list(sim.ticker['Reserve'])
+
+    scenarios = [dict(seed=1, max_elapsed=1.2),
+                 dict(seed=2, max_elapsed=1.2, trading_stddev=0.01),
+                 dict(seed=1, max_elapsed=1.5, final_price=1.1)]
+    results = fork(data, scenarios)
+    assert [r['params'] for r in results] == scenarios
+    assert results[0]['auction_elapsed'] == auction_elapsed
+    assert results[0]['reserve'] != results[1]['reserve']
+    again = fork(data, scenarios, processes=2)
+    for a, b in zip(results, again):
+        assert a['reserve'] == b['reserve'] and a['ticks'] == b['ticks']
+
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,239 @@
+"""
+headless runner for the simulations
+
+    python cli.py auction|trading|simple|orderbook [--config params.json] [--set key=value]
+                  [--output results.json] [--ticks ticks.bin] [--plot chart.html] [--profile]
+
+the config file is a json object overriding the scenario defaults, --set overrides
+single parameters (values are parsed as json). the results are printed as json
+or written to --output. only --plot imports the chart backend.
+"""
+from __future__ import division
+import sys
+import json
+import time
+import random
+import argparse
+
+SCENARIOS = dict()  # name -> (defaults, run)
+
+
+def scenario(name, **defaults):
+    def register(run):
+        SCENARIOS[name] = (defaults, run)
+        return run
+    return register
+
+
+def _sweep_defaults(**kargs):
+    from sweep import DEFAULTS
+    d = dict(DEFAULTS, seed=42, runner='steps')
+    d.update(kargs)
+    return d
+
+
+def _run_auction(p, sim):
+    if p['runner'] == 'events':
+        sim.run_auction_events(factor=p['auction_factor'], const=p['auction_const'])
+    else:
+        sim.run_auction(factor=p['auction_factor'], const=p['auction_const'])
+
+
+@scenario('auction', **_sweep_defaults())
+def run_auction(p, verbose=False):
+    "simulator auction, parameters as in sweep.DEFAULTS"
+    from sweep import gen_simulation, summarize
+    sim = gen_simulation(p)
+    sim.verbose = verbose
+    _run_auction(p, sim)
+    return summarize(sim), sim.ticker, 'draw'
+
+
+@scenario('trading', **_sweep_defaults())
+def run_trading(p, verbose=False):
+    "simulator auction followed by trading against the mint"
+    from sweep import gen_simulation, summarize
+    sim = gen_simulation(p)
+    sim.verbose = verbose
+    _run_auction(p, sim)
+    auction_elapsed = sim.auction.elapsed
+    sim.run_trading(auction_elapsed * p['max_elapsed'], stddev=p['trading_stddev'],
+                    final_price=p['final_price'] * sim.mint.ask)
+    result = summarize(sim)
+    result['auction_elapsed'] = auction_elapsed
+    return result, sim.ticker, 'draw'
+
+
+@scenario('simple', seed=42, num_bidders=3000, total_purchase_amount=20 * 10**6,
+          median_valuation=5 * 10**6, std_deviation=0.25, prealloc=0.25,
+          auction_factor=30 * 10**6, auction_const=10**3, pre_auction_reserve=0)
+def run_simple(p, verbose=False):
+    "simple_sim auction, prealloc is a fraction of the supply"
+    from ctoken import Token
+    from simple_auction import Auction
+    from simple_sim import Simulation, gen_bids
+    random.seed(p['seed'])
+    bids = gen_bids(p['num_bidders'], p['total_purchase_amount'], p['median_valuation'],
+                    p['std_deviation'] * p['median_valuation'])
+    token = Token()
+    token.issue(p['prealloc'] * Auction.supply, 'prealloc')
+    auction = Auction(token, factor=p['auction_factor'], const=p['auction_const'],
+                      pre_auction_reserve=p['pre_auction_reserve'])
+    sim = Simulation(auction, bids)
+    sim.verbose = verbose
+    sim.run_auction()
+    result = dict(closing_price=auction.closing_price, reserve=auction.reserve,
+                  supply=token.supply, unfilled_bids=len(sim.bids), elapsed=auction.elapsed,
+                  ticks=len(sim.ticker))
+    return result, sim.ticker, 'simple_draw'
+
+
+@scenario('orderbook', seed=42, num_traders=10, max_tokens=10000, cash_per_token=100,
+          strategies=['BuyAndHold', 'AverageOut'], start_price=100, mu=1, sigma=0.01,
+          end_time=3600, interval=10, scheduler=False)
+def run_orderbook(p, verbose=False):
+    "traders with random cash and tokens against a market maker, as traders.test"
+    import traders
+    from exchange import Exchange, NotAvailable
+    from ticks import TickStore
+    random.seed(p['seed'])
+    exchange = Exchange()
+    max_tokens = p['max_tokens']
+    max_amount = p['cash_per_token'] * max_tokens
+    strategies = [getattr(traders, name) for name in p['strategies']]
+    mms = traders.MarketMaker(start_price=p['start_price'], mu=p['mu'], sigma=p['sigma'])
+    market_maker = traders.Trader(exchange, max_amount, max_tokens * p['num_traders'], mms)
+    population = [market_maker]
+    for i in range(p['num_traders']):
+        amount = random.randint(0, max_amount)
+        tokens = random.randint(0, max_tokens)
+        population.append(traders.Trader(exchange, amount, tokens, random.choice(strategies)()))
+
+    exchange.time = 1
+    triggers = 0
+    if p['scheduler']:
+        from scheduler import Scheduler
+        scheduler = Scheduler(exchange, quantum=p['interval'])
+        for t in population:
+            scheduler.add(t, exchange.time + p['interval'])
+        scheduler.run(p['end_time'] + 1)
+        triggers = scheduler.triggers
+    else:
+        while exchange.time < p['end_time']:
+            exchange.time += p['interval']
+            for t in population:
+                try:
+                    t.trigger()
+                except NotAvailable:  # no bid or ask yet, skip the trigger as the Scheduler does
+                    pass
+                triggers += 1
+
+    ticker = TickStore()
+    for t in exchange.ticker:
+        ticker.append(dict(time=t.time, Price=t.price, Amount=t.amount))
+    prices = ticker['Price'] if 'Price' in ticker else []
+    amounts = ticker['Amount'] if 'Amount' in ticker else []
+    result = dict(trades=len(ticker), triggers=triggers,
+                  last_price=prices[-1] if prices else None,
+                  volume=sum(amounts), open_bids=len(exchange._bids),
+                  open_asks=len(exchange._asks),
+                  tokens=sum(t.tokens for t in population),
+                  cash=sum(t.cash for t in population))
+    return result, ticker, None
+
+
+def plot_ticks(ticks, filename, module):
+    "charts the ticks with draw/simple_draw, or all columns for other scenarios"
+    if module:
+        draw = __import__(module).draw
+        return draw(ticks, filename=filename)
+    import render
+    from collections import OrderedDict
+    sections = OrderedDict((key, [(key, ticks['time'], ticks[key])])
+                           for key in ticks.keys() if key != 'time')
+    return render.plot(sections, title='ticks', filename=filename)
+
+
+def parse_set(items):
+    "key=value pairs, values are json or plain strings"
+    params = dict()
+    for item in items:
+        key, _, value = item.partition('=')
+        try:
+            params[key] = json.loads(value)
+        except ValueError:
+            params[key] = value
+    return params
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('scenario', choices=sorted(SCENARIOS))
+    parser.add_argument('--config', help='json file with parameters')
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE')
+    parser.add_argument('--output', help='write the results json here instead of stdout')
+    parser.add_argument('--ticks', help='save the ticks (see ticks.TickStore.load)')
+    parser.add_argument('--plot', help='chart file, *.html or *.png')
+    parser.add_argument('--profile', action='store_true', help='report hot path timings')
+    parser.add_argument('--verbose', action='store_true', help='print the simulation steps')
+    args = parser.parse_args(argv)
+
+    defaults, run = SCENARIOS[args.scenario]
+    params = dict(defaults)
+    overrides = json.load(open(args.config)) if args.config else dict()
+    overrides.update(parse_set(args.set))
+    unknown = set(overrides) - set(defaults)
+    if unknown:
+        parser.error('unknown parameters: {}'.format(', '.join(sorted(unknown))))
+    params.update(overrides)
+
+    if args.profile:
+        import profiling
+        profiling.enable()
+    started = time.time()
+    try:
+        result, ticks, draw_module = run(params, verbose=args.verbose)
+    finally:
+        if args.profile:
+            profiling.disable()
+            profiling.stats.report()
+    result = dict(scenario=args.scenario, params=params, results=result,
+                  runtime=time.time() - started)
+
+    if args.ticks:
+        ticks.save(args.ticks)
+    if args.plot:
+        plot_ticks(ticks, args.plot, draw_module)
+    out = json.dumps(result, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(out + '\n')
+    else:
+        print out
+
+
+def test():
+    import os
+    import tempfile
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        for name, overrides in [('auction', ['num_bidders=50', 'runner="events"']),
+                                ('trading', ['num_bidders=50']),
+                                ('simple', ['num_bidders=300']),
+                                ('orderbook', []),  # polling, strategies meet an empty side
+                                ('orderbook', ['end_time=600', 'scheduler=true']),
+                                ('orderbook', ['scheduler=true', 'num_traders=50'])]:
+            main([name, '--output', path] + ['--set=' + s for s in overrides])
+            result = json.load(open(path))
+            assert result['scenario'] == name
+            assert result['params']['seed'] == 42
+            assert result['results']
+        assert result['results']['trades'] > 0
+        assert 'draw' not in sys.modules and 'plotly' not in sys.modules
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
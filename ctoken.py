@@ -1,5 +1,8 @@
 from __future__ import division
 from math import sqrt
+from array import array
+from collections import namedtuple
+from ticks import pack_array, unpack_array
 
 
 def assert_almost_equal(a, b, threshold=0.0001):
@@ -12,6 +15,15 @@ def assert_almost_equal(a, b, threshold=0.0001):
 xassert = assert_almost_equal
 
 
+def _numpy():
+    "numpy or None if not installed, imported on first use to keep importing ctoken fast"
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
 class InsufficientFundsError(Exception):
     pass
 
@@ -24,31 +36,244 @@ class Beneficiary(object):
 
 
 class Token(object):
+    """
+    ledger with holders mapped to integer account ids
+    balances live in a contiguous array, the supply is maintained on every change
+    """
+
+    typecode = 'd'
 
     def __init__(self):
-        self.accounts = dict()
+        self._holders = []  # account id -> holder
+        self._ids = dict()  # holder -> account id
+        self._balances = array(self.typecode)
+        self._supply = 0
+        self._claims = []  # deferred issuance, see defer
+        self.version = 0  # changes with every issuance, sale and transfer
 
     @property
     def supply(self):
-        return sum(self.accounts.values())
+        return self._supply
+
+    @property
+    def accounts(self):
+        self.claim_all()
+        return Accounts(self)
+
+    def account_id(self, holder):
+        "returns the account id of holder, opens an account if necessary"
+        try:
+            return self._ids[holder]
+        except KeyError:
+            i = self._ids[holder] = len(self._holders)
+            self._holders.append(holder)
+            self._balances.append(0)
+            return i
 
     def issue(self, num, recipient):
-        if recipient not in self.accounts:
-            self.accounts[recipient] = 0
-        self.accounts[recipient] += num
+        self._balances[self.account_id(recipient)] += num
+        self._supply += num
+        self.version += 1
+
+    def issue_many(self, nums, recipients):
+        """
+        issues nums[i] to recipients[i] in one pass, recipients may repeat.
+        returns the total issued
+        """
+        total = self._credit_many(nums, recipients)
+        self._supply += total
+        self.version += 1
+        return total
+
+    def _credit_many(self, nums, recipients):
+        ids = map(self._ids.get, recipients)
+        if None in ids:  # open the new accounts in order
+            ids = [self.account_id(r) if i is None else i for r, i in zip(recipients, ids)]
+        np = _numpy()
+        if np is not None and isinstance(self._balances, array):
+            balances = np.frombuffer(self._balances, dtype=self.typecode)
+            nums = np.asarray(nums, dtype=balances.dtype)
+            np.add.at(balances, ids, nums)
+            return float(nums.sum())
+        balances = self._balances
+        for i, num in zip(ids, nums):
+            balances[i] += num
+        return sum(nums)
+
+    # deferred issuance
+
+    def defer(self, claims):
+        """
+        issues claims.total at once, but credits the holders only when their
+        balance is accessed or by claim_batch. see Claims
+        """
+        self._claims.append(claims)
+        self._supply += claims.total
+        self.version += 1
+
+    def _claim(self, holder):
+        for claims in self._claims:
+            num = claims.pop(holder)
+            if num:
+                self._balances[self.account_id(holder)] += num
+        if not all(self._claims):
+            self._claims = [c for c in self._claims if c]
+
+    def claim_batch(self, size=10000):
+        "credits up to size pending claims, returns the number credited"
+        done = 0
+        while self._claims and done < size:
+            recipients, nums = self._claims[0].pop_batch(size - done)
+            self._credit_many(nums, recipients)
+            done += len(recipients)
+            if not self._claims[0]:
+                self._claims.pop(0)
+        return done
+
+    def claim_all(self):
+        while self._claims:
+            self.claim_batch()
 
     def sell(self, num, owner):
-        if self.accounts[owner] < num:
-            raise InsufficientFundsError('{} < {}'.format(self.accounts[owner], num))
-        self.accounts[owner] -= num
+        if self._claims:
+            self._claim(owner)
+        i = self._ids[owner]
+        if self._balances[i] < num:
+            raise InsufficientFundsError('{} < {}'.format(self._balances[i], num))
+        self._balances[i] -= num
+        self._supply -= num
+        self.version += 1
 
     def transfer(self, _from, _to, value):
-        assert self.accounts[_from] >= value
-        self.accounts[_from] -= value
-        self.accounts[_to] += value
+        if self._claims:
+            self._claim(_from)
+        i = self._ids[_from]
+        assert self._balances[i] >= value
+        self._balances[i] -= value
+        self._balances[self.account_id(_to)] += value
+        self.version += 1
 
     def balanceOf(self, address):
-        return self.accounts.get(address, 0)
+        if self._claims:
+            self._claim(address)
+        i = self._ids.get(address)
+        if i is None:
+            return 0
+        return self._balances[i]
+
+    # snapshots
+
+    def snapshot(self):
+        "copies of the holders and balances, the account ids are their positions"
+        self.claim_all()
+        return TokenSnapshot(self._holders[:], self._balances[:], self._supply)
+
+    def restore(self, snapshot):
+        "holders, account ids and balances as of the snapshot, any snapshot in any order"
+        self._holders = snapshot.holders[:]
+        self._ids = dict((holder, i) for i, holder in enumerate(self._holders))
+        self._balances = snapshot.balances[:]
+        self._supply = snapshot.supply
+        self._claims = []  # snapshots are taken with all claims credited
+        self.version += 1
+
+    # pickled with the balance array as bytes (ticks.pack_array).
+    # the account ids are rebuilt from the holders
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_ids']
+        if isinstance(self._balances, array):  # fixed.Token keeps a list of python ints
+            state['_balances'] = pack_array(self._balances)
+        return state
+
+    def __setstate__(self, state):
+        if isinstance(state['_balances'], tuple):
+            state['_balances'] = unpack_array(state['_balances'])
+        self.__dict__.update(state)
+        self._ids = dict((holder, i) for i, holder in enumerate(self._holders))
+
+
+TokenSnapshot = namedtuple('TokenSnapshot', 'holders, balances, supply')
+
+
+class Claims(object):
+    """
+    tokens owed to the buyers of an auction, num * value / total_value * factor each.
+    orders map recipients to ids and values (see auction.Orders).
+    every claim is popped once, by holder or in batches in order of the ids
+    """
+
+    def __init__(self, orders, num, total_value, factor=1):
+        self.orders = orders
+        self.num = num
+        self.total_value = total_value
+        self.factor = factor
+        self.total = num * factor
+        self._claimed = bytearray(len(orders))
+        self._next = 0  # ids before are claimed
+        self._pending = len(orders)
+
+    def __len__(self):
+        return self._pending
+
+    def _share(self, i):
+        return self.num * self.orders.values[i] / self.total_value * self.factor
+
+    def pop(self, holder):
+        i = self.orders.index(holder)
+        if i is None or self._claimed[i]:
+            return 0
+        self._claimed[i] = 1
+        self._pending -= 1
+        return self._share(i)
+
+    def pop_batch(self, size):
+        "(recipients, nums) of the next size pending claims"
+        recipients, nums = [], []
+        claimed, i = self._claimed, self._next
+        while len(recipients) < size and i < len(claimed):
+            if not claimed[i]:
+                claimed[i] = 1
+                recipients.append(self.orders.recipients[i])
+                nums.append(self._share(i))
+            i += 1
+        self._next = i
+        self._pending -= len(recipients)
+        return recipients, nums
+
+
+class Accounts(object):
+    "read only mapping view of the balances by holder"
+
+    def __init__(self, token):
+        self._token = token
+
+    def __getitem__(self, holder):
+        return self._token._balances[self._token._ids[holder]]
+
+    def __contains__(self, holder):
+        return holder in self._token._ids
+
+    def __iter__(self):
+        return iter(self._token._holders)
+
+    def __len__(self):
+        return len(self._token._holders)
+
+    def get(self, holder, default=None):
+        if holder not in self._token._ids:
+            return default
+        return self[holder]
+
+    def keys(self):
+        return list(self._token._holders)
+
+    def values(self):
+        return list(self._token._balances)
+
+    def items(self):
+        return zip(self._token._holders, self._token._balances)
 
 
 class PriceSupplyCurve(object):
@@ -111,17 +336,48 @@ class PriceSupplyCurve(object):
         return s
 
 
+def memoized(fn):
+    """
+    property computed once per state version of the object (its version attribute).
+    changes outside the version, e.g. of the curve or beneficiary, are not tracked.
+    every read builds the version, so plain properties are faster for cheap values
+    """
+    name = fn.__name__
+
+    def get(self):
+        version = self.version
+        if self._cached_version != version:
+            self._cache = dict()
+            self._cached_version = version
+        try:
+            return self._cache[name]
+        except KeyError:
+            value = self._cache[name] = fn(self)
+            return value
+    get.__name__ = name
+    get.__doc__ = fn.__doc__
+    return property(get)
+
+
 class Mint(object):
 
+    _cached_version = None
+
     def __init__(self, curve, beneficiary, auction):
         self.curve = curve
         self.auction = auction
         self.auction.mint = self
         self.beneficiary = beneficiary
         self.auction = auction
+        self.events = auction.events  # mint_buy and mint_sell
         self.token = Token()
         self.reserve = 0
 
+    @property
+    def version(self):
+        "changes with the reserve, the token supply and the end of the auction"
+        return self.reserve, self.token.version, self.auction.ended
+
     # supplies
 
     @property
@@ -138,6 +394,20 @@ class Mint(object):
         added = num * self.beneficiary.factor
         return self.curve.cost(self.supply_by_reserve, added)
 
+    def _issued_for(self, value):
+        "tokens buy(value) issues to the buyer, priced from the supply after adding value"
+        s = self.curve.supply(self.reserve + value)
+        return self.curve.issued(s, value) * self.beneficiary.factor
+
+    def _value_to_buy(self, num):
+        """
+        the value for which buy issues num tokens, _issued_for solved for the value:
+        factor * (supply(reserve + 2 * value) - supply(reserve + value)) = num
+        """
+        f, b = self.curve.f, self.curve.b
+        d = f * num / self.beneficiary.factor
+        return d * (1.5 * d + sqrt(2 * d**2 + b**2 + 2 * f * self.reserve)) / f
+
     def _purchase_cost(self, num):
         "the value offered if tokens are bought back"
         if not self.token.supply:
@@ -149,8 +419,11 @@ class Mint(object):
     # public functions
 
     def buy(self, value, recipient=None):
+        ev = self.events.mint_buy
+        if ev:
+            ev(recipient, value, self.auction.elapsed)
         self.reserve += value
-        s = self.supply_by_reserve
+        s = self.curve.supply(self.reserve)  # changed state, skip the cache
         issued = self.curve.issued(s, value)
         return self._issue(issued, recipient)
 
@@ -161,12 +434,40 @@ class Mint(object):
         self.token.issue(seigniorage, self.beneficiary)
         return num_sold
 
+    def _issue_many(self, nums, recipients):
+        "_issue for each recipient, the seigniorage is credited once"
+        factor = self.beneficiary.factor
+        np = _numpy()
+        if np is not None:
+            nums = np.asarray(nums, dtype=float)
+            num_issued = float(nums.sum())
+            num_sold = nums * factor
+        else:
+            num_issued = sum(nums)
+            num_sold = [num * factor for num in nums]
+        num_sold = self.token.issue_many(num_sold, recipients)
+        self.token.issue(num_issued - num_sold, self.beneficiary)
+        return num_sold
+
+    def _issue_deferred(self, orders, num_issued, total_value):
+        """
+        _issue_many of num_issued pro rata to the order values, the buyers
+        are credited when they claim, see Token.defer
+        """
+        claims = Claims(orders, num_issued, total_value, self.beneficiary.factor)
+        self.token.defer(claims)
+        self.token.issue(num_issued - claims.total, self.beneficiary)
+        return claims.total
+
     def sell(self, num, owner=None):
         value = self._purchase_cost(num)
         self.token.sell(num, owner)  # can throw
         assert value < self.reserve or xassert(value, self.reserve)
         value = min(value, self.reserve)
         self.reserve -= value
+        ev = self.events.mint_sell
+        if ev:
+            ev(owner, num, self.auction.elapsed)
         return value
 
     def burn(self, num, owner=None):
@@ -179,11 +480,11 @@ class Mint(object):
     def isauction(self):
         return not self.auction.ended
 
-    @property
+    @memoized
     def ask(self):
         return self._sale_cost(1)
 
-    @property
+    @memoized
     def bid(self):
         # if not self.reserve:
         if self.isauction:
@@ -192,14 +493,14 @@ class Mint(object):
         assert bid <= self.ask, (bid, self.ask)
         return bid
 
-    @property
+    @memoized
     def price(self):
         return self.curve.cost(self.supply_by_reserve, 1)
 
-    @property
+    @memoized
     def mktcap(self):
         return self.ask * self.token.supply
 
-    @property
+    @memoized
     def valuation(self):  # (ask - bid) * supply
         return max(0, self.mktcap - self.reserve)
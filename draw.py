@@ -1,22 +1,27 @@
 # Learn about API authentication here: https://plot.ly/python/getting-started
 # Find your api_key here: https://plot.ly/settings/api
 import collections
-import plotly.plotly as py
-import plotly.graph_objs as go
-from plotly import tools
+import render
 
 
-def draw(ticks):
+def draw(ticks, filename=None, max_points=2000, online=False, output_dir=None):
+    """
+    filename: *.html or *.png, rendered locally, defaults to continuoustoken4.html
+    in output_dir (render.OUTPUT_DIR). online uploads the chart to plotly instead
+    """
 
     if False:  # remove most of initial auction
-        max_mkt_cap = max([t['MktCap'] for t in ticks])
-        ticks = [t for t in ticks if t['Max_Valuation'] < max_mkt_cap]
+        max_mkt_cap = max(ticks['MktCap'])
+        start = next(i for i, v in enumerate(ticks['Max_Valuation']) if v < max_mkt_cap)
     else:
-        ticks_r = [t for t in ticks if t['Reserve'] > 0]
-        ticks = ticks[-int(len(ticks_r) * 1.1):]
+        num_reserve = int(sum(1 for r in ticks['Reserve'] if r > 0) * 1.1)
+        start = max(0, len(ticks) - num_reserve) if num_reserve else 0
 
     def tdata(key):
-        return [(t['time'], t[key]) for t in ticks if key in t]
+        if key not in ticks:
+            return []
+        return [(t, v) for t, v in zip(ticks['time'][start:], ticks[key][start:])
+                if v == v]  # skip missing
 
     traces1 = []
     traces2 = []
@@ -27,8 +32,7 @@ def draw(ticks):
         d = tdata(key)
         assert d
         name = key.replace('_', ' ')
-        s = go.Scatter(x=[_[0] for _ in d], y=[_[1] for _ in d], name=name)
-        t.append(s)
+        t.append((name, [_[0] for _ in d], [_[1] for _ in d]))
 
     def chart2(key):
         chart(key, traces2)
@@ -58,19 +62,13 @@ def draw(ticks):
             chart('Change_' + key, traces4)
 
     ######
-    SHOW = collections.OrderedDict(
-        Prices=traces1,
-        Valuation=traces2,
-        Supply=traces3,
-        # Changes=traces4
-    )
-
-    fig = tools.make_subplots(rows=len(SHOW), cols=1,
-                              subplot_titles=SHOW.keys())
-
-    for i, traces in enumerate(SHOW.values()):
-        for t in traces:
-            fig.append_trace(t, i + 1, 1)
-
-    fig['layout'].update(title='Continuous Token')
-    plot_url = py.plot(fig, filename='continuoustoken4')
+    SHOW = collections.OrderedDict([
+        ('Prices', traces1),
+        ('Valuation', traces2),
+        ('Supply', traces3),
+        # ('Changes', traces4),
+    ])
+
+    return render.plot(SHOW, title='Continuous Token', filename=filename,
+                       online_name='continuoustoken4', max_points=max_points, online=online,
+                       output_dir=output_dir)
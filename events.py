@@ -0,0 +1,163 @@
+"""
+structured events emitted by Exchange and Auction
+
+every event type is a list of subscribers. engines emit like
+
+    ev = self.events.fill
+    if ev:
+        ev(o, price, amount, time)
+
+so an event without subscribers costs an attribute lookup and nothing else.
+
+event types and their arguments:
+    order(order, time)                  order placed at the exchange
+    cancel(order, time)                 order cancelled by its owner
+    fill(order, price, amount, time)    order (partially) executed
+    tick(tick)                          trade recorded in the exchange ticker
+    market(side, amount, time)          market order, side is 'buy' or 'sell'
+    auction_start(factor, const)
+    auction_order(recipient, value, elapsed)
+    auction_finalized(elapsed, price, avg_price, reserve, supply)
+    mint_buy(recipient, value, elapsed) mint events are emitted on the sink of its auction
+    mint_sell(owner, num, elapsed)
+"""
+import sys
+
+
+EVENT_TYPES = ('order', 'cancel', 'fill', 'tick', 'market', 'auction_start', 'auction_order',
+               'auction_finalized', 'mint_buy', 'mint_sell')
+
+
+class Event(list):
+    "the subscribers of one event type, calling it dispatches to all of them"
+
+    def __call__(self, *args):
+        for callback in self:
+            callback(*args)
+
+
+class EventSink(object):
+
+    def __init__(self):
+        for event_type in EVENT_TYPES:
+            setattr(self, event_type, Event())
+
+    def _event(self, event_type):
+        if event_type not in EVENT_TYPES:
+            raise KeyError('unknown event type {}'.format(event_type))
+        return getattr(self, event_type)
+
+    def subscribe(self, event_type, callback):
+        self._event(event_type).append(callback)
+
+    def unsubscribe(self, event_type, callback):
+        self._event(event_type).remove(callback)
+
+    def __getstate__(self):
+        "only the event types are pickled, a restored sink has no subscribers"
+        return EVENT_TYPES
+
+    def __setstate__(self, event_types):
+        for event_type in event_types:
+            setattr(self, event_type, Event())
+
+
+FORMATS = dict(
+    order=lambda o, time: 'order {} {}'.format(time, o),
+    cancel=lambda o, time: 'cancel {} {}'.format(time, o),
+    fill=lambda o, price, amount, time: '{} {} {} price:{} amount:{}'.format(
+        'partial' if o.amount else 'filled', time, o, price, amount),
+    tick=lambda t: 'tick {} amount:{} price:{}'.format(t.time, t.amount, t.price),
+    market=lambda side, amount, time: 'market {} {} amount:{}'.format(side, time, amount),
+    auction_start=lambda factor, const: 'auction start factor:{} const:{}'.format(factor, const),
+    auction_order=lambda recipient, value, elapsed: 'auction order {} {} value:{}'.format(
+        elapsed, recipient, value),
+    auction_finalized=lambda elapsed, price, avg_price, reserve, supply:
+        'finalizing auction at price:{} avg price:{:,.2f} reserve:{:,.0f} supply:{}'.format(
+            price, avg_price, reserve, supply),
+    mint_buy=lambda recipient, value, elapsed: 'mint buy {} {} value:{}'.format(
+        elapsed, recipient, value),
+    mint_sell=lambda owner, num, elapsed: 'mint sell {} {} num:{}'.format(elapsed, owner, num),
+)
+
+
+class BufferedWriter(object):
+    """
+    formats events as lines and writes them in chunks of buffer_size lines
+    """
+
+    def __init__(self, fobj, buffer_size=10000):
+        self.fobj = fobj
+        self.buffer_size = buffer_size
+        self._lines = []
+
+    def attach(self, sink, *event_types):
+        "subscribe to event_types, all by default"
+        for event_type in event_types or EVENT_TYPES:
+            sink.subscribe(event_type, self._writer(FORMATS[event_type]))
+        return self
+
+    def _writer(self, fmt):
+        lines = self._lines
+
+        def write(*args):
+            lines.append(fmt(*args))
+            if len(lines) >= self.buffer_size:
+                self.flush()
+        return write
+
+    def flush(self):
+        if self._lines:
+            self.fobj.write('\n'.join(self._lines) + '\n')
+            del self._lines[:]
+        self.fobj.flush()
+
+    def close(self):
+        self.flush()
+        if self.fobj not in (sys.stdout, sys.stderr):
+            self.fobj.close()
+
+
+def open_writer(path, buffer_size=10000):
+    return BufferedWriter(open(path, 'w'), buffer_size)
+
+
+def console_writer():
+    "writes every event immediately to stdout"
+    return BufferedWriter(sys.stdout, buffer_size=1)
+
+
+def test():
+    import StringIO
+    from exchange import Exchange, BuyOrder, SellOrder
+
+    ex = Exchange()
+    # no subscribers, nothing is formatted
+    ex.place(SellOrder(10, 5, callback=lambda *a: None))
+
+    out = StringIO.StringIO()
+    writer = BufferedWriter(out, buffer_size=100).attach(ex.events, 'fill', 'tick')
+    fills = []
+    ex.events.subscribe('fill', lambda o, price, amount, time: fills.append((o, amount)))
+    o = BuyOrder(11, 3, callback=lambda *a: None)
+    ex.place(o)
+    assert fills[0] == (o, 3)
+    assert len(fills) == 2
+    assert out.getvalue() == ''  # still buffered
+    writer.flush()
+    lines = out.getvalue().splitlines()
+    assert len(lines) == 3 and lines[-1].startswith('tick'), lines
+
+    try:
+        ex.events.subscribe('unknown', None)
+        assert False
+    except KeyError:
+        pass
+
+    import pickle
+    sink = pickle.loads(pickle.dumps(ex.events))
+    assert not sink.fill and not sink.tick and isinstance(sink.order, Event)
+
+
+if __name__ == '__main__':
+    test()
@@ -1,11 +1,16 @@
 from __future__ import division
 import bisect
-from collections import namedtuple
+import itertools
+from collections import namedtuple, OrderedDict
+from events import EventSink
 
 
 class Order(object):
 
+    _ids = itertools.count()
+
     def __init__(self, price, amount, callback=None):
+        self.id = next(Order._ids)
         self.price = price
         self.amount = amount
         self._callback = callback
@@ -45,81 +50,261 @@ class NotAvailable(Exception):
     pass
 
 
+class BookSide(object):
+    """
+    one side of the book, orders are grouped in price levels
+    levels are sorted by key (price for bids, -price for asks), so the best level is last.
+    orders within a level are kept in time priority and indexed by order id
+    quotes use running sums of amount and cost over the levels from the best level
+    outwards. they are summed as deep as a quote needs and dropped from the best
+    changed level on, so a quote never subtracts from the total of deeper levels
+    """
+
+    def __init__(self, sign):
+        self._sign = sign
+        self._keys = []  # sorted level keys
+        self._levels = dict()  # key -> OrderedDict(order id -> order)
+        self._index = dict()  # order id -> key
+        self._cum_amounts = []  # per level from the best, amount of it and all better levels
+        self._cum_costs = []  # the same for amount * price
+        self._dirty = float('-inf')  # key of the best changed level, its sums are stale
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, o):
+        return o.id in self._index
+
+    def __iter__(self):
+        "orders in priority order"
+        for key in reversed(self._keys):
+            for o in self._levels[key].itervalues():
+                yield o
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def add(self, o):
+        key = o.price * self._sign
+        level = self._levels.get(key)
+        if level is None:
+            level = self._levels[key] = OrderedDict()
+            bisect.insort(self._keys, key)
+        level[o.id] = o
+        self._index[o.id] = key
+        self._changed(key)
+
+    def remove(self, o):
+        key = self._index.pop(o.id, None)
+        if key is None:
+            raise ValueError('{} not in book'.format(o))
+        level = self._levels[key]
+        del level[o.id]
+        if not level:
+            del self._levels[key]
+            del self._keys[bisect.bisect_left(self._keys, key)]
+        self._changed(key)
+
+    def filled(self, o, amount):
+        "amount of o was executed"
+        self._changed(o.price * self._sign)
+
+    def _changed(self, key):
+        if key > self._dirty:
+            self._dirty = key
+
+    def _depth(self):
+        "the running sums of amount and cost of the levels summed so far, best first"
+        cum_amounts, cum_costs = self._cum_amounts, self._cum_costs
+        if self._dirty != float('-inf'):
+            valid = len(self._keys) - bisect.bisect_right(self._keys, self._dirty)
+            del cum_amounts[valid:]
+            del cum_costs[valid:]
+            self._dirty = float('-inf')
+        return cum_amounts, cum_costs
+
+    def _sum_level(self):
+        "adds the next level to the running sums, False once all levels are summed"
+        cum_amounts, cum_costs = self._cum_amounts, self._cum_costs
+        j = len(cum_amounts)
+        if j == len(self._keys):
+            return False
+        key = self._keys[-1 - j]
+        # summed from the orders, a level total kept up to date with fills would drift
+        amount = sum(o.amount for o in self._levels[key].itervalues())
+        cum_amounts.append(amount + (cum_amounts[-1] if j else 0))
+        cum_costs.append(amount * key * self._sign + (cum_costs[-1] if j else 0))
+        return True
+
+    def quote_amount(self, amount):
+        "(amount, cost) of taking up to amount from the best levels on"
+        cum_amounts, cum_costs = self._depth()
+        while (not cum_amounts or cum_amounts[-1] < amount) and self._sum_level():
+            pass
+        i = bisect.bisect_left(cum_amounts, amount)  # the level partially taken
+        if i == len(cum_amounts):  # all levels
+            return (cum_amounts[-1], cum_costs[-1]) if cum_amounts else (0, 0)
+        taken, cost = (cum_amounts[i - 1], cum_costs[i - 1]) if i else (0, 0)
+        return amount, cost + (amount - taken) * self._keys[-1 - i] * self._sign
+
+    def take_until(self, wanted):
+        """
+        the amount to take from the best levels on, wanted(price) is the total amount
+        worth taking at price and must not grow towards worse prices.
+        the level where the wanted amount falls into the depth is found by bisection
+        over the levels summed so far, or by summing more levels
+        """
+        cum_amounts, cum_costs = self._depth()
+        keys, sign = self._keys, self._sign
+
+        def within(j):  # the wanted amount at level j ends at or before it
+            return wanted(keys[-1 - j] * sign) < cum_amounts[j]
+
+        j = len(cum_amounts) - 1
+        if j >= 0 and within(j):
+            lo = 0
+            while lo < j:
+                mid = (lo + j) // 2
+                if within(mid):
+                    j = mid
+                else:
+                    lo = mid + 1
+        else:
+            while self._sum_level():
+                j += 1
+                if within(j):
+                    break
+            else:  # all levels
+                return cum_amounts[-1] if cum_amounts else 0
+        taken = cum_amounts[j - 1] if j else 0
+        return max(taken, wanted(keys[-1 - j] * sign))
+
+    def quote_cost(self, cost):
+        "(amount, unspent cost) of taking the best levels on for up to cost"
+        cum_amounts, cum_costs = self._depth()
+        while (not cum_costs or cum_costs[-1] < cost) and self._sum_level():
+            pass
+        i = bisect.bisect_left(cum_costs, cost)  # the level partially taken
+        if i == len(cum_costs):  # all levels
+            return (cum_amounts[-1], cost - cum_costs[-1]) if cum_costs else (0, cost)
+        taken, spent = (cum_amounts[i - 1], cum_costs[i - 1]) if i else (0, 0)
+        return taken + (cost - spent) / (self._keys[-1 - i] * self._sign), 0
+
+    def best(self):
+        return next(self._levels[self._keys[-1]].itervalues())
+
+    @property
+    def best_price(self):
+        return self._keys[-1] * self._sign
+
+
 class Exchange(object):
 
-    def __init__(self):
-        self._buy_orders = list()
-        self._sell_orders = list()
+    def __init__(self, events=None):
+        self._bids = BookSide(1)
+        self._asks = BookSide(-1)
         self.ticker = list()
         self.time = 0
+        self.events = events or EventSink()
+        self.indicators = dict()  # (cls, window) -> indicator
 
     def update_time(self, time):
         self.time = time
 
-    def place(self, o):
+    def indicator(self, cls, window):
+        """
+        the indicator maintained by the exchange for cls and window,
+        created and fed with the existing ticker on first use
+        """
+        key = (cls, window)
+        indicator = self.indicators.get(key)
+        if indicator is None:
+            indicator = self.indicators[key] = cls(window)
+            for t in self.ticker:
+                indicator.update(t)
+        return indicator
+
+    def _side(self, o):
         if isinstance(o, BuyOrder):
-            bisect.insort(self._buy_orders, o)
-        else:
-            assert isinstance(o, SellOrder)
-            bisect.insort(self._sell_orders, o)
+            return self._bids
+        assert isinstance(o, SellOrder)
+        return self._asks
+
+    def place(self, o):
+        ev = self.events.order
+        if ev:
+            ev(o, self.time)
+        self._side(o).add(o)
         self.match()
 
     def cancel(self, o):
-        if isinstance(o, BuyOrder):
-            self._buy_orders.remove(o)
-        else:
-            assert isinstance(o, SellOrder)
-            self._sell_orders.remove(o)
-        # print 'removed', o
+        self._side(o).remove(o)
+        ev = self.events.cancel
+        if ev:
+            ev(o, self.time)
+
+    def _execute(self, o, price, amount, side):
+        side.filled(o, amount)
+        o.execute(price, amount)
+        ev = self.events.fill
+        if ev:
+            ev(o, price, amount, self.time)
+
+    def _record(self, amount, price):
+        t = Tick(amount=amount, price=price, time=self.time)
+        self.ticker.append(t)
+        if self.indicators:
+            for indicator in self.indicators.itervalues():
+                indicator.update(t)
+        ev = self.events.tick
+        if ev:
+            ev(t)
 
     def _cleanup(self, o):
         if o.amount == 0:
-            self.cancel(o)
+            self._side(o).remove(o)
             return True
         assert o.amount > 0
 
     def match(self):
-        while (self._buy_orders and self._sell_orders):
-            bo, so = self._buy_orders[-1], self._sell_orders[0]
+        while (self._bids and self._asks):
+            bo, so = self._bids.best(), self._asks.best()
             # print bo, so, bo >= so
             if not (bo >= so):
                 break
             # match
-            print 'match', bo, so
             amount = min(bo.amount, so.amount)
             price = (so.price + bo.price) / 2
             # update orders
-            bo.execute(price, amount)
-            so.execute(price, amount)
+            self._execute(bo, price, amount, self._bids)
+            self._execute(so, price, amount, self._asks)
             # remove filled orders
             assert True in (self._cleanup(so), self._cleanup(bo))
-            self.ticker.append(Tick(amount=amount, price=price, time=self.time))
+            self._record(amount, price)
 
-    def _at_market(self, amount, lst, dryrun=False):
+    def _at_market(self, amount, side, dryrun=False):
         assert amount > 0
-        print '_at_market', amount, lst, dryrun
-        # if amount > sum(o.amount for o in lst):
-        #     s = sum(o.amount for o in lst)
-        #     print s, amount, amount > s, type(s), type(amount), amount - s > 0
-        #     raise NotAvailable()
+        if dryrun:
+            return side.quote_amount(amount)[1]
+        ev = self.events.market
+        if ev:
+            ev('sell' if side is self._bids else 'buy', amount, self.time)
         cost = 0
-        for o in list(lst):
+        while amount > 0 and side:
+            o = side.best()
             a = min(amount, o.amount)
             amount -= a
             cost += a * o.price
-            if not dryrun:
-                o.execute(o.price, a)
-                self._cleanup(o)
-                self.ticker.append(Tick(amount=a, price=o.price, time=self.time))
-            if amount == 0:
-                break
+            self._execute(o, o.price, a, side)
+            self._cleanup(o)
+            self._record(a, o.price)
         return cost
 
     def sell_market(self, amount, dryrun=False):
-        return self._at_market(amount, list(reversed(self._buy_orders)), dryrun)
+        return self._at_market(amount, self._bids, dryrun)
 
     def buy_market(self, amount, dryrun=False):
-        return self._at_market(amount, self._sell_orders, dryrun)
+        return self._at_market(amount, self._asks, dryrun)
 
     def sell_cost(self, amount):
         return self.sell_market(amount, dryrun=True)
@@ -127,42 +312,37 @@ class Exchange(object):
     def buy_cost(self, amount):
         return self.buy_market(amount, dryrun=True)
 
+    def sell_depth(self, wanted):
+        "the amount worth selling into the bids, see BookSide.take_until"
+        return self._bids.take_until(wanted)
+
+    def buy_depth(self, wanted):
+        "the amount worth buying from the asks, see BookSide.take_until"
+        return self._asks.take_until(wanted)
+
     def buyable(self, cash, partial=True):
-        amount = 0
-        for o in self._sell_orders:
-            a = min(o.amount, cash / o.price)
-            amount += a
-            cash -= a * o.price
-            if cash == 0:
-                break
+        amount, cash = self._asks.quote_cost(cash)
         if cash > 0 and not partial:
             raise NotAvailable()
         return amount, cash
 
     def sellable(self, amount, partial=True):
-        target = amount
-        cash = 0
-        for o in reversed(self._buy_orders):
-            a = min(o.amount, amount)
-            amount -= a
-            cash += a * o.price
-            if amount == 0:
-                break
-        if amount > 0 and not partial:
+        sold, cash = self._bids.quote_amount(amount)
+        if sold < amount and not partial:
             raise NotAvailable()
-        return target - amount, cash
+        return sold, cash
 
     @property
     def bid(self):
-        if not len(self._buy_orders):
+        if not self._bids:
             raise NotAvailable()
-        return self._buy_orders[-1].price
+        return self._bids.best_price
 
     @property
     def ask(self):
-        if not len(self._sell_orders):
+        if not self._asks:
             raise NotAvailable()
-        return self._sell_orders[0].price
+        return self._asks.best_price
 
     @property
     def spread(self):
@@ -170,8 +350,10 @@ class Exchange(object):
 
 
 def test():
+    from events import console_writer
 
     ex = Exchange()
+    console_writer().attach(ex.events, 'tick')
 
     def cb(o, price, amount):
         t = 'partial' if o.amount else 'filled'
@@ -229,5 +411,120 @@ def test():
 
     print ex.ticker
 
+
+def test_book():
+    ex = Exchange()
+    fills = []
+
+    def cb(o, price, amount):
+        fills.append((o, price, amount))
+
+    first = SellOrder(100, amount=5, callback=cb)
+    second = SellOrder(100, amount=5, callback=cb)
+    cheaper = SellOrder(90, amount=5, callback=cb)
+    cancelled = SellOrder(95, amount=5, callback=cb)
+    for o in (first, second, cheaper, cancelled):
+        ex.place(o)
+    assert ex.ask == 90
+    ex.cancel(cancelled)
+    assert cancelled not in ex._asks
+    assert list(ex._asks) == [cheaper, first, second]
+    try:
+        ex.cancel(cancelled)
+        assert False
+    except ValueError:
+        pass
+
+    # time priority within the level
+    ex.place(BuyOrder(100, amount=10, callback=cb))
+    assert [o for o, p, a in fills if isinstance(o, SellOrder)] == [cheaper, first]
+    assert list(ex._asks) == [second] and not ex._bids
+    assert ex.ask == 100
+
+
+def test_depth():
+    import random
+    rnd = random.Random(7)
+    ex = Exchange()
+
+    def walk(orders, amount=None, cash=None):
+        "(amount, cost) of sweeping the orders in priority order"
+        taken = cost = 0
+        for o in orders:
+            a = o.amount
+            if amount is not None:
+                a = min(a, amount - taken)
+            if cash is not None:
+                a = min(a, (cash - cost) / o.price)
+            taken += a
+            cost += a * o.price
+        return taken, cost
+
+    def walk_until(orders, wanted):
+        "the amount taken while wanted(price) is more than taken"
+        taken = 0
+        for o in orders:
+            a = min(o.amount, max(0, wanted(o.price) - taken))
+            taken += a
+            if a < o.amount:
+                break
+        return taken
+
+    def close(a, b):
+        return abs(a - b) <= 1e-6 * max(1, abs(a), abs(b))
+
+    def exact(quote, expected):
+        "equal up to the rounding of the scaled expectations"
+        return all(abs(a - b) <= 1e-12 * abs(b) for a, b in zip(quote, expected))
+
+    resting = []
+    for i in range(2000):
+        r = rnd.random()
+        if r < 0.5 or not resting:
+            cls = rnd.choice([BuyOrder, SellOrder])
+            price = rnd.randint(90, 110) if cls is SellOrder else rnd.randint(80, 100)
+            o = cls(price, rnd.randint(1, 20), callback=lambda *args: None)
+            ex.place(o)
+            if o.amount:
+                resting.append(o)
+        else:
+            o = resting.pop(rnd.randrange(len(resting)))
+            if o.amount and o in ex._side(o):
+                ex.cancel(o)
+        resting = [o for o in resting if o in ex._side(o)]
+        if i % 50:
+            continue
+        for size in [1, 10, 100, 10**4]:
+            amount, cost = ex._asks.quote_amount(size)
+            expected = walk(ex._asks, amount=size)
+            assert close(amount, expected[0]) and close(cost, expected[1]), (size, amount, cost)
+            assert close(ex.sell_cost(size), walk(ex._bids, amount=size)[1])
+            amount, cash = ex.buyable(size * 100)
+            expected = walk(ex._asks, cash=size * 100)
+            assert close(amount, expected[0]) and close(cash, size * 100 - expected[1])
+        for side, wanted in [(ex._bids, lambda price: (price - 85) * 30),
+                             (ex._asks, lambda price: (105 - price) * 30),
+                             (ex._asks, lambda price: float('inf') if price < 95 else 0)]:
+            assert close(side.take_until(wanted), walk_until(side, wanted))
+        if ex._asks:  # tiny quotes come from the best level alone
+            best = ex._asks.best_price
+            assert ex._asks.quote_amount(1e-12) == (1e-12, 1e-12 * best)
+            assert ex.buyable(1e-12 * best) == (1e-12, 0)
+
+    # a deep level under small ones does not cost the quotes at the top their precision
+    for deep, price, size in [(1e17, 1, 1), (1e8, 0.5, 1e-3)]:
+        ex = Exchange()
+        for o in [BuyOrder(price, deep), BuyOrder(99, size), BuyOrder(100, size),
+                  SellOrder(300, deep), SellOrder(101, size), SellOrder(102, size)]:
+            ex.place(o)  # nothing crosses
+        assert exact(ex.sellable(2 * size), (2 * size, 199 * size))
+        assert exact(ex.sellable(1.5 * size), (1.5 * size, 149.5 * size))
+        assert exact(ex.buyable(203 * size), (2 * size, 0))
+        assert exact([ex.buy_cost(1.5 * size)], [152 * size])
+        assert exact([ex.sell_depth(lambda p: 1.5 * size if p > 98 else 0)], [1.5 * size])
+
+
 if __name__ == '__main__':
     test()
+    test_book()
+    test_depth()
@@ -0,0 +1,372 @@
+"""
+integer fixed-point Mint and Auction following contract_interface.sol
+
+reserves are integer wei, token amounts integer units of 10**-18 tokens,
+prices wei per token. curve parameters and the issuance fraction are fixed
+point numbers with PRECISION. all arithmetic is on python ints, so results
+are exact and independent of the magnitude of the numbers.
+
+rounding, always in favour of the contract:
+    curve.reserve(supply)      rounded up
+    curve.supply(reserve)      rounded down
+    Mint.buy                   issued = supply(R + value) - supply(R), the
+                               beneficiary's share rounded up
+    Mint.sell                  the purchase value rounded down
+    Auction.claim_tokens       shares rounded down, the dust goes to the
+                               beneficiary once all tokens are claimed
+"""
+from __future__ import division
+from math import sqrt
+import ctoken
+from ctoken import Beneficiary, InsufficientFundsError
+
+UNIT = 10**18  # token units per token, wei per ether
+PRECISION = 10**18
+
+
+def isqrt(n):
+    "floor of the square root of n"
+    if n < 0:
+        raise ValueError('square root of negative number')
+    if n == 0:
+        return 0
+    # float estimate, shifted into the float range, refined by newton iterations
+    shift = max(0, n.bit_length() - 1000) // 2 * 2
+    x = int(sqrt(n >> shift)) << (shift // 2)
+    if x == 0:
+        x = 1
+    while True:
+        y = (x + n // x) // 2
+        if abs(y - x) <= 1:
+            break
+        x = y
+    while y * y > n:
+        y -= 1
+    while (y + 1) * (y + 1) <= n:
+        y += 1
+    return y
+
+
+def to_fixed(x, precision=PRECISION):
+    "converts a float (ether, tokens, curve parameters) to fixed point"
+    return int(round(x * precision))
+
+
+class Token(ctoken.Token):
+    "balances are python ints, arrays would overflow at 2**64 units"
+
+    def __init__(self):
+        super(Token, self).__init__()
+        self._balances = []
+
+
+class PriceSupplyCurve(object):
+    """
+    price = b + f * supply in ether per token, b and f fixed point.
+    with both units at 10**18: reserve = b * s + f * s**2 / (2 * UNIT), in PRECISION
+    """
+
+    def __init__(self, factor, base_price):
+        self.f = factor
+        self.b = base_price
+
+    @classmethod
+    def from_floats(cls, factor=1., base_price=0):
+        "the curve of ctoken.PriceSupplyCurve(factor, base_price)"
+        return cls(to_fixed(factor), to_fixed(base_price))
+
+    def price(self, supply):
+        "wei per token"
+        return (self.b * UNIT + self.f * supply) // PRECISION
+
+    def price_at_reserve(self, reserve):
+        return self.price(self.supply(reserve))
+
+    def supply(self, reserve):
+        f, b = self.f, self.b
+        if not f:
+            return reserve * PRECISION // b
+        # f * s**2 + 2 * UNIT * b * s - 2 * UNIT * PRECISION * reserve = 0
+        bu = b * UNIT
+        return (isqrt(bu * bu + 2 * UNIT * PRECISION * f * reserve) - bu) // f
+
+    def supply_at_price(self, price):
+        assert price * PRECISION >= self.b * UNIT
+        return (price * PRECISION - self.b * UNIT) // self.f
+
+    def reserve(self, supply):
+        d = 2 * UNIT * PRECISION
+        return -(-(2 * UNIT * self.b * supply + self.f * supply * supply) // d)
+
+    def reserve_at_price(self, price):
+        return self.reserve(self.supply_at_price(price))
+
+    def avg_price_at_reserve(self, reserve):
+        return reserve * UNIT // self.supply(reserve)
+
+    def cost(self, supply, num):
+        return self.reserve(supply + num) - self.reserve(supply)
+
+    def issued(self, supply, added_reserve):
+        reserve = self.reserve(supply)
+        return self.supply(reserve + added_reserve) - self.supply(reserve)
+
+    def mktcap(self, supply):
+        return self.price(supply) * supply // UNIT
+
+
+class Mint(object):
+
+    def __init__(self, curve, beneficiary, auction):
+        self.curve = curve
+        self.beneficiary = beneficiary
+        self.fraction = to_fixed(beneficiary.fraction)
+        self.auction = auction
+        self.auction.mint = self
+        self.token = Token()
+        self.reserve = 0
+
+    @property
+    def supply_by_reserve(self):
+        return self.curve.supply(self.reserve)
+
+    def _split(self, num_issued):
+        "(sold, seigniorage) of newly issued tokens"
+        num_sold = num_issued * (PRECISION - self.fraction) // PRECISION
+        return num_sold, num_issued - num_sold
+
+    def _sale_cost(self, num):
+        "the value to pay for num tokens, which requires issuing the seigniorage too"
+        assert num >= 0
+        added = -(-num * PRECISION // (PRECISION - self.fraction))
+        return self.curve.cost(self.supply_by_reserve, added)
+
+    def _purchase_cost(self, num):
+        "the value offered if tokens are bought back"
+        if not self.token.supply:
+            return 0
+        assert num >= 0 and num <= self.token.supply
+        return self.reserve * num // self.token.supply
+
+    def buy(self, value, recipient=None):
+        issued = self.curve.supply(self.reserve + value) - self.supply_by_reserve
+        self.reserve += value
+        return self._issue(issued, recipient)
+
+    def _issue(self, num_issued, recipient):
+        num_sold, seigniorage = self._split(num_issued)
+        self.token.issue(num_sold, recipient)
+        self.token.issue(seigniorage, self.beneficiary)
+        return num_sold
+
+    def sell(self, num, owner=None):
+        value = self._purchase_cost(num)
+        self.token.sell(num, owner)  # can throw
+        self.reserve -= value
+        return value
+
+    def burn(self, num, owner=None):
+        self.token.sell(num, owner)  # can throw
+
+    @property
+    def isauction(self):
+        return not self.auction.ended
+
+    @property
+    def ask(self):
+        return self._sale_cost(UNIT)
+
+    @property
+    def bid(self):
+        if self.isauction or not self.token.supply:
+            return 0
+        return self.reserve * UNIT // self.token.supply
+
+    @property
+    def mktcap(self):
+        return self.ask * self.token.supply // UNIT
+
+    @property
+    def valuation(self):
+        return max(0, self.mktcap - self.reserve)
+
+
+class Auction(object):
+    """
+    the auctioned supply (token units) is factor // (elapsed + const), elapsed in seconds.
+    orders are accepted up to the reserve that ends the auction,
+    tokens are issued by claim_tokens after the auction ended
+    """
+
+    def __init__(self, factor, const):
+        self.mint = None  # set by mint
+        self.factor = factor
+        self.const = const
+        self.elapsed = 0
+        self.funds = dict()  # recipient -> accepted wei
+        self.ended = False
+        self.settled = False
+        self.reserve = 0  # received value
+        self.total_issuance = 0
+        self.sold_issuance = 0  # total_issuance without the seigniorage
+        self.issued_value = 0
+        self.issued = 0
+        self.final_price = 0
+
+    @property
+    def auctioned_supply(self):
+        return self.factor // (self.elapsed + self.const)
+
+    @property
+    def _total_supply(self):
+        return self.mint.token.supply + self.auctioned_supply
+
+    @property
+    def price(self):
+        "wei per token all bidders would pay, the seigniorage is paid for by the bidders"
+        auctioned_supply = self.auctioned_supply
+        added_reserve = self.mint.curve.reserve(self._total_supply) - self.mint.reserve
+        sold_supply, seigniorage = self.mint._split(auctioned_supply)
+        if not sold_supply:
+            return 0
+        return added_reserve * UNIT // sold_supply
+
+    @property
+    def missing_reserve_to_end_auction(self):
+        target = self.mint.curve.reserve(self._total_supply)
+        return max(0, target - self.mint.reserve - self.reserve)
+
+    def order(self, recipient, value):
+        "returns the refunded value"
+        assert not self.ended
+        accepted = min(value, self.missing_reserve_to_end_auction)
+        self.funds[recipient] = self.funds.get(recipient, 0) + accepted
+        self.reserve += accepted
+        if self.missing_reserve_to_end_auction == 0:  # this call ended the auction
+            self.finalize_auction()
+        return value - accepted
+
+    def finalize_auction(self):
+        assert not self.ended  # call only once
+        assert self.reserve
+        self.ended = True
+        self.final_price = self.price
+        mint = self.mint
+        self.total_issuance = mint.curve.supply(self.reserve + mint.reserve) - mint.token.supply
+        assert self.total_issuance > 0
+        self.sold_issuance = mint._split(self.total_issuance)[0]
+        mint.reserve += self.reserve
+
+    def claim_tokens(self, recipients):
+        assert self.ended
+        token = self.mint.token
+        for recipient in recipients:
+            value = self.funds.pop(recipient, 0)
+            if not value:
+                continue
+            num = value * self.sold_issuance // self.reserve
+            self.issued_value += value
+            self.issued += num
+            token.issue(num, recipient)
+        if self.issued_value == self.reserve and not self.settled:
+            self.settled = True
+            # seigniorage and the rounding dust
+            token.issue(self.total_issuance - self.issued, self.mint.beneficiary)
+
+    def claim_all(self):
+        self.claim_tokens(list(self.funds))
+
+
+def test_isqrt():
+    import random
+    rnd = random.Random(0)
+    for n in range(1000):
+        r = isqrt(n)
+        assert r * r <= n < (r + 1) * (r + 1)
+    for bits in [52, 53, 64, 100, 200, 1100, 3000]:
+        for i in range(100):
+            k = rnd.getrandbits(bits) + 1
+            for n in [k * k - 1, k * k, k * k + 1, k]:
+                r = isqrt(n)
+                assert r * r <= n < (r + 1) * (r + 1), (bits, n)
+
+
+def test_curve():
+    floats = ctoken.PriceSupplyCurve(factor=0.000001, base_price=1)
+    curve = PriceSupplyCurve.from_floats(factor=0.000001, base_price=1)
+    for tokens in [1, 1000, 10**6, 10**9]:
+        s = tokens * UNIT
+        r = curve.reserve(s)
+        assert abs(r / UNIT - floats.reserve(tokens)) <= floats.reserve(tokens) * 1e-12
+        assert curve.supply(r) == s
+        assert curve.supply(r - 1) < s
+        assert abs(curve.price(s) / UNIT - floats.price(tokens)) <= floats.price(tokens) * 1e-12
+    flat = PriceSupplyCurve.from_floats(factor=0, base_price=2)
+    assert flat.supply(flat.reserve(3 * UNIT)) == 3 * UNIT
+
+
+def test_mint():
+    import random
+    rnd = random.Random(1)
+    curve = PriceSupplyCurve.from_floats(factor=0.000001, base_price=1)
+    auction = Auction(factor=10**12 * UNIT, const=10**3)
+    mint = Mint(curve, Beneficiary(0.2), auction)
+    auction.ended = True
+    buyers = range(20)
+    for i in range(200):
+        mint.buy(rnd.randint(1, 10**6 * UNIT), rnd.choice(buyers))
+        # rounding never lets the supply exceed the reserve
+        assert mint.token.supply == curve.supply(mint.reserve)
+    bought = sum(mint.token.balanceOf(b) for b in buyers)
+    assert mint.token.balanceOf(mint.beneficiary) == mint.token.supply - bought
+    assert abs(mint.token.balanceOf(mint.beneficiary) / mint.token.supply - 0.2) < 1e-12
+    assert mint.bid <= mint.ask
+    for b in buyers:
+        mint.sell(mint.token.balanceOf(b), b)
+    mint.sell(mint.token.balanceOf(mint.beneficiary), mint.beneficiary)
+    assert mint.token.supply == 0 and mint.reserve >= 0
+    try:
+        mint.sell(1, buyers[0])
+        assert False
+    except InsufficientFundsError:
+        pass
+
+
+def test_auction():
+    curve = PriceSupplyCurve.from_floats(factor=0.000001, base_price=1)
+    auction = Auction(factor=10**12 * UNIT, const=10**3)
+    mint = Mint(curve, Beneficiary(0.2), auction)
+    start_price = auction.price
+    bidders = range(1000)
+    while not auction.ended:
+        auction.elapsed += 3600
+        for b in bidders:
+            if auction.ended:
+                break
+            refund = auction.order(b, 10**4 * UNIT)
+        assert auction.price < start_price
+    assert refund > 0
+    assert mint.reserve == auction.reserve
+    funds = dict(auction.funds)
+    auction.claim_tokens(bidders[:10])
+    assert not auction.settled
+    auction.claim_all()
+    assert auction.settled and not auction.funds
+    assert mint.token.supply == auction.total_issuance == curve.supply(mint.reserve)
+    # bidders get the same price
+    for b in bidders:
+        assert mint.token.balanceOf(b) == funds.get(b, 0) * auction.sold_issuance // mint.reserve
+    sold, seigniorage = mint._split(auction.total_issuance)
+    assert 0 <= mint.token.balanceOf(mint.beneficiary) - seigniorage < len(bidders)
+    assert mint.bid <= mint.ask
+
+
+def test():
+    test_isqrt()
+    test_curve()
+    test_mint()
+    test_auction()
+
+
+if __name__ == '__main__':
+    test()
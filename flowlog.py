@@ -0,0 +1,327 @@
+"""
+binary log of the engine inputs and its replay
+
+Recorder subscribes to the events of a Mint (its auction's sink) and an
+Exchange and appends every input as a fixed size record:
+
+    auction_start, auction_order, finalize, mint_buy, mint_sell,
+    place (buy/sell), cancel, market (buy/sell)
+
+recipients and orders are logged as integer ids. close() appends the final
+state of the engines as a trailer. replay() memory maps a log, feeds the records to
+fresh engines without strategies or random numbers, reports the throughput and
+compares the final state with the trailer.
+
+    python flowlog.py record run.flow [--seed 42] [--num-bidders 300]
+    python flowlog.py replay run.flow
+
+Token.transfer is not logged, logs of runs using it do not verify.
+"""
+from __future__ import division
+import sys
+import json
+import mmap
+import time
+import struct
+import argparse
+from collections import defaultdict
+from ctoken import Mint, PriceSupplyCurve, Beneficiary
+from auction import Auction
+from exchange import Exchange, BuyOrder, SellOrder
+
+MAGIC = 'FLOW1\n'
+RECORD = struct.Struct('<BQddd')  # kind, key (recipient or order id), time, a, b
+
+# record kinds
+(AUCTION_START, AUCTION_ORDER, FINALIZE, MINT_BUY, MINT_SELL, PLACE_BUY, PLACE_SELL, CANCEL,
+ MARKET_BUY, MARKET_SELL) = range(10)
+END = 255  # key is the number of state values following
+KINDS = ['auction_start', 'auction_order', 'finalize', 'mint_buy', 'mint_sell', 'place_buy',
+         'place_sell', 'cancel', 'market_buy', 'market_sell']
+
+
+def final_state(mint=None, exchange=None, holders=()):
+    "the values compared by replay, holders are the recipients in the order of their ids"
+    state = [0.] * 9
+    if mint is not None:
+        token = mint.token
+        state[:4] = [mint.reserve, token.supply, mint.auction.reserve,
+                     sum(token.balanceOf(h) * (i + 1) for i, h in enumerate(holders))]
+    if exchange is not None:
+        state[4:] = [len(exchange.ticker), sum(t.amount for t in exchange.ticker),
+                     sum(t.amount * t.price for t in exchange.ticker),
+                     sum(o.amount for o in exchange._bids),
+                     sum(o.amount for o in exchange._asks)]
+    return state
+
+
+class Recorder(object):
+    """
+    appends the inputs of mint and exchange to fobj, buffered in chunks of
+    buffer_size records
+    """
+
+    def __init__(self, fobj, mint=None, exchange=None, buffer_size=10000):
+        self.fobj = fobj
+        self.mint = mint
+        self.exchange = exchange
+        self.buffer_size = buffer_size
+        self.records = 0
+        self._buffer = []
+        self._ids = dict()  # recipient -> id
+        self._holders = []  # recipients by id
+        header = dict(mint=None, exchange=exchange is not None)
+        if mint is not None:
+            header['mint'] = dict(factor=mint.curve.f, base_price=mint.curve.b,
+                                  issuance_fraction=mint.beneficiary.fraction,
+                                  lazy_claims=mint.auction.lazy_claims)
+            events = mint.events
+            for event_type in ['auction_start', 'auction_order', 'auction_finalized',
+                               'mint_buy', 'mint_sell']:
+                events.subscribe(event_type, getattr(self, '_' + event_type))
+        if exchange is not None:
+            for event_type in ['order', 'cancel', 'market']:
+                exchange.events.subscribe(event_type, getattr(self, '_' + event_type))
+        fobj.write(MAGIC)
+        fobj.write(json.dumps(header) + '\n')
+
+    def _id(self, recipient):
+        i = self._ids.get(recipient)
+        if i is None:
+            i = self._ids[recipient] = len(self._holders)
+            self._holders.append(recipient)
+        return i
+
+    def _write(self, kind, key=0, time=0., a=0., b=0.):
+        self._buffer.append(RECORD.pack(kind, key, time, a, b))
+        if len(self._buffer) >= self.buffer_size:
+            self.flush()
+
+    def _auction_start(self, factor, const):
+        self._write(AUCTION_START, a=factor, b=const)
+
+    def _auction_order(self, recipient, value, elapsed):
+        self._write(AUCTION_ORDER, self._id(recipient), elapsed, value)
+
+    def _auction_finalized(self, elapsed, *args):
+        self._write(FINALIZE, time=elapsed)
+
+    def _mint_buy(self, recipient, value, elapsed):
+        self._write(MINT_BUY, self._id(recipient), elapsed, value)
+
+    def _mint_sell(self, owner, num, elapsed):
+        self._write(MINT_SELL, self._id(owner), elapsed, num)
+
+    def _order(self, o, time):
+        kind = PLACE_BUY if isinstance(o, BuyOrder) else PLACE_SELL
+        self._write(kind, o.id, time, o.price, o.amount)
+
+    def _cancel(self, o, time):
+        self._write(CANCEL, o.id, time)
+
+    def _market(self, side, amount, time):
+        self._write(MARKET_BUY if side == 'buy' else MARKET_SELL, time=time, a=amount)
+
+    def flush(self):
+        if self._buffer:
+            self.records += len(self._buffer)
+            self.fobj.write(''.join(self._buffer))
+            del self._buffer[:]
+        self.fobj.flush()
+
+    def close(self):
+        "appends the final state and closes fobj"
+        state = final_state(self.mint, self.exchange, self._holders)
+        self.flush()
+        self.fobj.write(RECORD.pack(END, len(state), 0, 0, 0))
+        self.fobj.write(struct.pack('<{}d'.format(len(state)), *state))
+        self.fobj.close()
+
+
+def noop(*args):
+    pass
+
+
+def replay(path):
+    """
+    feeds the log to fresh engines, returns dict(records, seconds, rate, counts, state,
+    expected, ok). expected is None for a log without trailer (a run still recording)
+    """
+    with open(path, 'rb') as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        assert buf.readline() == MAGIC, 'not a flow log'
+        header = json.loads(buf.readline())
+        offset = buf.tell()
+        mint = exchange = None
+        if header['mint']:
+            h = header['mint']
+            mint = Mint(PriceSupplyCurve(factor=h['factor'], base_price=h['base_price']),
+                        Beneficiary(h['issuance_fraction']), Auction(lazy_claims=h['lazy_claims']))
+        if header['exchange']:
+            exchange = Exchange()
+        auction = mint.auction if mint else None
+        orders = dict()  # logged id -> order
+        holders = 0  # recipient ids seen
+        counts = defaultdict(int)
+        unpack, size, end = RECORD.unpack_from, RECORD.size, len(buf)
+        expected = None
+        started = time.time()
+        while offset + size <= end:
+            kind, key, t, a, b = unpack(buf, offset)
+            offset += size
+            if kind == MINT_BUY:
+                auction.elapsed = t
+                mint.buy(a, key)
+                holders = max(holders, key + 1)
+            elif kind == AUCTION_ORDER:
+                auction.elapsed = t
+                auction.order(key, a)
+                holders = max(holders, key + 1)
+            elif kind == PLACE_BUY or kind == PLACE_SELL:
+                exchange.time = t
+                o = (BuyOrder if kind == PLACE_BUY else SellOrder)(a, b, callback=noop)
+                orders[key] = o
+                exchange.place(o)
+            elif kind == CANCEL:
+                exchange.time = t
+                exchange.cancel(orders.pop(key))
+            elif kind == MARKET_BUY:
+                exchange.time = t
+                exchange.buy_market(a)
+            elif kind == MARKET_SELL:
+                exchange.time = t
+                exchange.sell_market(a)
+            elif kind == MINT_SELL:
+                auction.elapsed = t
+                mint.sell(a, key)
+            elif kind == FINALIZE:
+                if not auction.ended:  # not already ended by the last order
+                    auction.elapsed = t
+                    auction.finalize_auction()
+            elif kind == AUCTION_START:
+                auction.start(a, b)
+            elif kind == END:
+                expected = list(struct.unpack_from('<{}d'.format(key), buf, offset))
+                break
+            else:
+                raise ValueError('unknown record kind {} at {}'.format(kind, offset - size))
+            counts[KINDS[kind]] += 1
+        seconds = time.time() - started
+    finally:
+        buf.close()
+    records = sum(counts.values())
+    state = final_state(mint, exchange, range(holders))
+    ok = None if expected is None else state == expected
+    return dict(records=records, seconds=seconds, rate=records / seconds if seconds else 0,
+                counts=dict(counts), state=state, expected=expected, ok=ok)
+
+
+def record_simulation(path, p):
+    "the sweep simulation for the parameters p, auction and trading, logged to path"
+    import sweep
+    sim = sweep.gen_simulation(p)
+    recorder = Recorder(open(path, 'wb'), mint=sim.mint)
+    try:
+        sim.run_auction_events(factor=p['auction_factor'], const=p['auction_const'])
+        sweep.run_trading(sim, p)
+    finally:
+        recorder.close()
+    return recorder.records
+
+
+def report(result, out=sys.stdout):
+    print >>out, '{records} records in {seconds:.3f}s, {rate:,.0f} records/s'.format(**result)
+    for kind in KINDS:
+        if kind in result['counts']:
+            print >>out, '  {:<15} {:>10}'.format(kind, result['counts'][kind])
+    if result['ok'] is None:
+        print >>out, 'no final state in the log'
+    else:
+        print >>out, 'final state', 'verified' if result['ok'] else 'DIFFERS'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    sub = parser.add_subparsers(dest='command')
+    rec = sub.add_parser('record', help='log the sweep simulation (auction and trading)')
+    rec.add_argument('path')
+    rec.add_argument('--seed', type=int, default=42)
+    rec.add_argument('--num-bidders', type=int, default=300)
+    rep = sub.add_parser('replay', help='replay a log and verify its final state')
+    rep.add_argument('path')
+    args = parser.parse_args(argv)
+
+    if args.command == 'record':
+        import sweep
+        p = dict(sweep.DEFAULTS, seed=args.seed, num_bidders=args.num_bidders)
+        print 'recorded {} records'.format(record_simulation(args.path, p))
+        return 0
+    result = replay(args.path)
+    report(result)
+    return 0 if result['ok'] is not False else 1
+
+
+def test():
+    import os
+    import random
+    import tempfile
+    import sweep
+    import traders
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        # auction (events driven, finalized explicitly) and trading against the mint
+        p = dict(sweep.DEFAULTS, num_bidders=100, seed=1, max_elapsed=1.2)
+        records = record_simulation(path, p)
+        result = replay(path)
+        assert result['ok'] and result['records'] == records
+        assert result['counts']['auction_start'] == 1 and result['counts']['mint_buy'] > 0
+        sim = sweep.gen_simulation(p)
+        sim.run_auction_events(factor=p['auction_factor'], const=p['auction_const'])
+        sweep.run_trading(sim, p)
+        assert result['state'][:2] == [sim.mint.reserve, sim.mint.token.supply]
+
+        # exchange with limit, market orders and cancels, arbitrage against a mint
+        random.seed(5)
+        mint = sweep.gen_simulation(dict(p, num_bidders=10)).mint
+        exchange = Exchange()
+        recorder = Recorder(open(path, 'wb'), mint=mint, exchange=exchange, buffer_size=7)
+        mint.auction.start(factor=10**7, const=10**3)
+        mint.auction.order('prealloc', mint.auction.missing_reserve_to_end_auction)
+        population = [traders.Trader(exchange, 10**6, 5000,
+                                     traders.MarketMaker(mint.ask * 1.1, mu=1, sigma=0.02)),
+                      traders.Trader(exchange, 10**6, strategy=traders.Arbitrageur(mint))]
+        population += [traders.Trader(exchange, 10**4, 100, traders.AverageOut())
+                       for i in range(3)]
+        exchange.time = 1
+        while exchange.time < 1200:
+            exchange.time += 10
+            for t in population:
+                try:
+                    t.trigger()
+                except traders.NotAvailable:
+                    pass
+        recorder.close()
+        result = replay(path)
+        counts = result['counts']
+        assert result['ok'], (result['state'], result['expected'])
+        for kind in ['place_buy', 'place_sell', 'cancel', 'market_sell', 'mint_buy']:
+            assert counts[kind] > 0, kind
+        assert result['state'][4] == len(exchange.ticker) > 0
+
+        # a changed input shows in the final state
+        with open(path, 'r+b') as f:
+            data = f.read()
+            i = data.index('\n', len(MAGIC)) + 1 + RECORD.size  # the first order
+            record = list(RECORD.unpack_from(data, i))
+            record[3] *= 0.5
+            f.seek(i)
+            f.write(RECORD.pack(*record))
+        assert replay(path)['ok'] is False
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
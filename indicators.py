@@ -0,0 +1,208 @@
+"""
+rolling indicators over the exchange ticker
+
+indicators are updated by the Exchange with every recorded tick and evict
+old ticks when read, so reading a value is amortized O(1).
+strategies share them via Exchange.indicator(cls, window).
+a window of None covers all ticks.
+"""
+from __future__ import division
+from collections import deque
+from math import exp
+from exchange import NotAvailable
+
+
+class Indicator(object):
+
+    def __init__(self, window=None):
+        self.window = window
+        self._value = None  # kept up to date by update, for indicators of a single value
+
+    def __repr__(self):
+        return '<{}(window:{})>'.format(self.__class__.__name__, self.window)
+
+    def update(self, tick):
+        "called with every recorded tick, override to fold it into the state"
+        pass
+
+    def value(self, now):
+        "the stored _value, NotAvailable until an update set one"
+        if self._value is None:
+            raise NotAvailable()
+        return self._value
+
+
+class SMA(Indicator):
+    "simple moving average of the trade prices within the window"
+
+    def __init__(self, window=None):
+        super(SMA, self).__init__(window)
+        self._ticks = deque()
+        self._sum = 0
+
+    def update(self, tick):
+        self._ticks.append(tick)
+        self._sum += tick.price
+
+    def _evict(self, now):
+        if self.window is None:
+            return
+        oldest = now - self.window
+        ticks = self._ticks
+        while ticks and ticks[0].time <= oldest:
+            self._sum -= ticks.popleft().price
+        if not ticks:
+            self._sum = 0
+
+    def value(self, now):
+        self._evict(now)
+        if not self._ticks:
+            raise NotAvailable()
+        return self._sum / len(self._ticks)
+
+
+class VWAP(SMA):
+    "volume weighted average price within the window"
+
+    def __init__(self, window=None):
+        super(VWAP, self).__init__(window)
+        self._volume = 0
+
+    def update(self, tick):
+        self._ticks.append(tick)
+        self._sum += tick.price * tick.amount
+        self._volume += tick.amount
+
+    def _evict(self, now):
+        if self.window is None:
+            return
+        oldest = now - self.window
+        ticks = self._ticks
+        while ticks and ticks[0].time <= oldest:
+            t = ticks.popleft()
+            self._sum -= t.price * t.amount
+            self._volume -= t.amount
+        if not ticks:
+            self._sum = self._volume = 0
+
+    def value(self, now):
+        self._evict(now)
+        if not self._volume:
+            raise NotAvailable()
+        return self._sum / self._volume
+
+
+class EMA(Indicator):
+    """
+    exponential moving average of the trade prices,
+    the weight of a tick decays by 1/e every window
+    """
+
+    def __init__(self, window):
+        super(EMA, self).__init__(window)
+        self._weighted = 0
+        self._weight = 0
+        self._time = None
+
+    def update(self, tick):
+        if self._time is not None:
+            decay = exp(-(tick.time - self._time) / self.window)
+            self._weighted *= decay
+            self._weight *= decay
+        self._weighted += tick.price
+        self._weight += 1
+        self._time = tick.time
+
+    def value(self, now):
+        if not self._weight:
+            raise NotAvailable()
+        return self._weighted / self._weight
+
+
+class RollingMax(Indicator):
+    "max trade price within the window"
+
+    def __init__(self, window=None):
+        super(RollingMax, self).__init__(window)
+        self._ticks = deque()  # decreasing prices
+
+    def _dominates(self, a, b):
+        return a >= b
+
+    def update(self, tick):
+        ticks = self._ticks
+        while ticks and self._dominates(tick.price, ticks[-1].price):
+            ticks.pop()
+        ticks.append(tick)
+
+    def value(self, now):
+        ticks = self._ticks
+        if self.window is not None:
+            oldest = now - self.window
+            while ticks and ticks[0].time <= oldest:
+                ticks.popleft()
+        if not ticks:
+            raise NotAvailable()
+        return ticks[0].price
+
+
+class RollingMin(RollingMax):
+    "min trade price within the window"
+
+    def _dominates(self, a, b):
+        return a <= b
+
+
+def test():
+    from exchange import Tick
+    prices = [5, 3, 4, 8, 6, 2, 7]
+    ticks = [Tick(amount=i + 1, price=p, time=i * 10) for i, p in enumerate(prices)]
+
+    def naive(now, window):
+        return [t for t in ticks if t.time <= now and t.time > now - window]
+
+    window = 25
+    indicators = [SMA(window), VWAP(window), RollingMax(window), RollingMin(window), EMA(window)]
+    for t in ticks:
+        for i in indicators:
+            i.update(t)
+        now = t.time
+        sma, vwap, rmax, rmin, ema = [i.value(now) for i in indicators]
+        recent = naive(now, window)
+        assert sma == sum(r.price for r in recent) / len(recent)
+        assert abs(vwap - sum(r.price * r.amount for r in recent) /
+                   sum(r.amount for r in recent)) < 1e-9
+        assert rmax == max(r.price for r in recent)
+        assert rmin == min(r.price for r in recent)
+        assert min(prices) <= ema <= max(prices)
+
+    try:
+        SMA(window).value(0)
+        assert False
+    except NotAvailable:
+        pass
+
+    class LastPrice(Indicator):  # only overrides update
+        def update(self, tick):
+            self._value = tick.price
+
+    last = LastPrice()
+    try:
+        last.value(0)
+        assert False
+    except NotAvailable:
+        pass
+    for t in ticks:
+        last.update(t)
+    assert last.value(ticks[-1].time) == prices[-1]
+    Indicator().update(ticks[0])  # no-op
+    sma = indicators[0]
+    try:
+        sma.value(ticks[-1].time + window)
+        assert False
+    except NotAvailable:
+        pass
+
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,171 @@
+"""
+many mints as parallel arrays
+
+MintArray keeps reserve, supply, curve parameters and beneficiary factors of
+n tokens in numpy arrays and applies the ctoken.Mint operations to all of
+them at once. values and amounts broadcast against the tokens, e.g. one
+market shock for all of them or one value per token (0 leaves a token unchanged).
+the buyers of a token are one holder (held), the beneficiary is not tracked separately.
+"""
+from __future__ import division
+import numpy as np
+from ctoken import InsufficientFundsError
+from vcurve import PriceSupplyCurves
+
+
+class MintArray(object):
+
+    def __init__(self, factor, base_price, issuance_fraction=0, reserve=0, supply=0,
+                 held=None, ended=True):
+        """
+        parameters are scalars or arrays of the number of tokens.
+        supply is the token supply, which differs from the supply by reserve after sales.
+        held: the tokens of the buyers, which can be sold, defaults to supply.
+        ended: whether the auction of the token ended, there is no bid before
+        """
+        if held is None:
+            held = supply
+        factor, base_price, issuance_fraction, reserve, supply, held, ended = \
+            np.broadcast_arrays(*[np.asarray(a, dtype=float) for a in
+                                  (factor, base_price, issuance_fraction, reserve, supply,
+                                   held, ended)])
+        self.curves = PriceSupplyCurves(factor.copy(), base_price.copy())
+        self.fraction = issuance_fraction.copy()
+        self.factor = 1 / (1 - self.fraction)  # Beneficiary.factor
+        self.reserve = reserve.copy()
+        self.supply = supply.copy()
+        self.held = held.copy()
+        self.ended = ended.astype(bool)
+
+    @classmethod
+    def from_mints(cls, mints):
+        """
+        the current state of the given ctoken.Mint instances,
+        all tokens but the beneficiary's are held by the buyers
+        """
+        return cls(factor=[m.curve.f for m in mints],
+                   base_price=[m.curve.b for m in mints],
+                   issuance_fraction=[m.beneficiary.fraction for m in mints],
+                   reserve=[m.reserve for m in mints],
+                   supply=[m.token.supply for m in mints],
+                   held=[m.token.supply - m.token.balanceOf(m.beneficiary) for m in mints],
+                   ended=[not m.isauction for m in mints])
+
+    def __len__(self):
+        return len(self.reserve)
+
+    @property
+    def supply_by_reserve(self):
+        return self.curves.supply(self.reserve)
+
+    def _sale_cost(self, num):
+        num = np.asarray(num, dtype=float)
+        assert (num >= 0).all()
+        return self.curves.cost(self.supply_by_reserve, num * self.factor)
+
+    def _purchase_cost(self, num):
+        "the value offered if tokens are bought back"
+        num = np.asarray(num, dtype=float)
+        assert (num >= 0).all()
+        supply = self.supply
+        return np.where(supply > 0, self.reserve * num / np.where(supply > 0, supply, 1), 0)
+
+    def buy(self, value):
+        "the number of tokens sold per token for value, see Mint.buy"
+        value = np.asarray(value, dtype=float)
+        self.reserve += value
+        issued = self.curves.issued(self.curves.supply(self.reserve), value)
+        num_sold = issued * self.factor
+        self.supply += issued  # num_sold plus the seigniorage
+        self.held += num_sold
+        return num_sold
+
+    def sell(self, num):
+        "the value paid out per token for num tokens of the buyers, see Mint.sell"
+        num = np.broadcast_to(np.asarray(num, dtype=float), self.held.shape)
+        if (num > self.held).any():
+            i = int(np.argmax(num > self.held))
+            raise InsufficientFundsError('{} < {}'.format(self.held[i], num[i]))
+        value = np.minimum(self._purchase_cost(num), self.reserve)
+        self.supply -= num
+        self.held -= num
+        self.reserve -= value
+        return value
+
+    @property
+    def ask(self):
+        return self._sale_cost(1)
+
+    @property
+    def bid(self):
+        return np.where(self.ended, self._purchase_cost(1), 0)
+
+    @property
+    def price(self):
+        return self.curves.cost(self.supply_by_reserve, 1)
+
+    @property
+    def mktcap(self):
+        return self.ask * self.supply
+
+    @property
+    def valuation(self):
+        return np.maximum(0, self.mktcap - self.reserve)
+
+
+def test():
+    import random
+    from ctoken import Mint, PriceSupplyCurve, Beneficiary, xassert
+    from auction import Auction
+    rnd = random.Random(3)
+    params = [(rnd.choice([0.000001, 0.0001, 0.01]), rnd.choice([0, 1, 5]),
+               rnd.choice([0, 0.1, 0.2])) for i in range(50)]
+    mints = []
+    for f, b, fraction in params:
+        mint = Mint(PriceSupplyCurve(factor=f, base_price=b), Beneficiary(fraction), Auction())
+        mint.auction.start(factor=1, const=1)
+        mint.auction.ended = True
+        mints.append(mint)
+    mints[0].buy(1000, 'prealloc')
+    array = MintArray.from_mints(mints)
+    assert len(array) == len(mints)
+
+    def check():
+        for name in ['reserve', 'supply', 'held', 'ask', 'bid', 'price', 'mktcap', 'valuation']:
+            values = getattr(array, name)
+            for i, m in enumerate(mints):
+                if name == 'supply':
+                    expected = m.token.supply
+                elif name == 'held':
+                    expected = m.token.supply - m.token.balanceOf(m.beneficiary)
+                elif name == 'bid':  # Mint.bid asserts bid <= ask, which buy can break
+                    expected = m.reserve / m.token.supply if m.token.supply else 0
+                else:
+                    expected = getattr(m, name)
+                xassert(values[i], expected)
+
+    check()
+    for step in range(20):
+        values = [rnd.choice([0, 10, 1000, 10**5]) for m in mints]
+        sold = array.buy(values)
+        for i, m in enumerate(mints):
+            xassert(sold[i], m.buy(values[i], 'holder'))
+        check()
+        # the beneficiary's balance is negative with the float Mint, keep within the supply
+        nums = [rnd.random() * min(m.token.balanceOf('holder'), m.token.supply)
+                for m in mints]
+        paid = array.sell(nums)
+        for i, m in enumerate(mints):
+            xassert(paid[i], m.sell(nums[i], 'holder'))
+        check()
+    # one shock for all tokens
+    array.buy(100)
+    try:
+        array.sell(array.held + 1)
+        assert False
+    except InsufficientFundsError:
+        pass
+
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,168 @@
+"""
+the trading phase of simulator.Simulation for many price paths at once
+
+every path is the random walk of Simulation.run_trading, the market buys from
+the mint whenever the market price is above the ask. the walks are drawn as
+(steps, paths) matrices, the mint of every path is a reserve and a supply and
+every step updates the paths buying in it with the closed form curve.
+
+    paths = trading_paths(mint, 10000, max_elapsed, stddev=0.005, final_price=1.2 * mint.ask)
+    paths.summary()
+"""
+from __future__ import division
+import numpy as np
+from vcurve import PriceSupplyCurves
+
+
+class TradingPaths(object):
+    """
+    the state after every recorded step, arrays of (paths, recorded steps):
+    market_price, reserve, supply, ask, bid and active (the path was still trading).
+    elapsed holds the auction time of the recorded steps
+    """
+
+    columns = ['market_price', 'reserve', 'supply', 'ask', 'bid', 'active']
+
+    def __init__(self, elapsed, **arrays):
+        self.elapsed = np.asarray(elapsed)
+        for name in self.columns:
+            setattr(self, name, arrays[name])
+
+    def __len__(self):
+        return len(self.reserve)
+
+    @property
+    def steps_traded(self):
+        "recorded steps per path until the final price was reached"
+        return self.active.sum(axis=1)
+
+    def summary(self, percentiles=(5, 50, 95)):
+        "percentiles of the last recorded state over the paths"
+        return dict((name, np.percentile(getattr(self, name)[:, -1], percentiles).tolist())
+                    for name in self.columns if name != 'active')
+
+
+def trading_paths(mint, num_paths, max_elapsed, stddev, final_price, step=10, start_price=None,
+                  seed=None, every=1, chunk=256):
+    """
+    Simulation.run_trading for num_paths walks from the current state of mint, which is
+    not changed. a path stops trading once its price reached final_price, all paths
+    stop at max_elapsed. every: record every n-th step (and the last one).
+    chunk: steps drawn at once, bounds the memory to (chunk, num_paths) arrays
+    """
+    assert mint.token.supply > 0
+    assert not mint.isauction
+    rng = np.random.RandomState(seed)
+    start = mint.auction.elapsed
+    steps = (max_elapsed - start) / step
+    median = (final_price / mint.bid) ** (1 / steps)
+    num_steps = int(np.ceil(steps))
+    curves = PriceSupplyCurves(mint.curve.f, mint.curve.b)
+    factor = mint.beneficiary.factor
+
+    def ask(reserve):  # Mint.ask
+        return curves.cost(curves.supply(reserve), factor)
+
+    reserve = np.full(num_paths, mint.reserve, dtype=float)
+    supply = np.full(num_paths, mint.token.supply, dtype=float)
+    asks = ask(reserve)
+    price = np.full(num_paths, mint.auction.final_price if start_price is None
+                    else start_price, dtype=float)
+    running = np.ones(num_paths, dtype=bool)
+    recorded = dict((name, []) for name in TradingPaths.columns)
+    elapsed = []
+    for first in range(0, num_steps, chunk):
+        # only the paths still trading are drawn, one row per step
+        paths = np.flatnonzero(running)
+        m, n = min(chunk, num_steps - first), len(paths)
+        walk = price[paths] * np.cumprod(rng.normal(median, stddev, (m, n)), axis=0)
+        before = np.vstack([price[paths], walk[:-1]])
+        # run_trading stops at the first price above final_price
+        active = np.logical_and.accumulate(before < final_price, axis=0)
+        traded = active.sum(axis=0)
+        last = np.where(traded > 0, walk[np.maximum(traded - 1, 0), np.arange(n)], price[paths])
+        bidding = np.where(active, walk, 0)
+        r, sup, a = reserve[paths], supply[paths], asks[paths]
+        for j in range(m):
+            # the ask only moves on buys, which are rare, update the buying paths only
+            i = np.flatnonzero(bidding[j] > a)
+            if len(i):  # Mint.buy of the reserve to the market price
+                added = curves.reserve_at_price(walk[j, i]) - curves.reserve_at_price(a[i])
+                r[i] += added
+                sup[i] += curves.issued(curves.supply(r[i]), added)
+                a[i] = ask(r[i])
+            k = first + j + 1
+            if k % every and k != num_steps:
+                continue
+            elapsed.append(start + k * step)
+            price[paths], running[paths] = np.where(active[j], walk[j], last), active[j]
+            reserve[paths], supply[paths], asks[paths] = r, sup, a
+            for name, value in [('market_price', price), ('reserve', reserve),
+                                ('supply', supply), ('ask', asks), ('bid', reserve / supply),
+                                ('active', running)]:
+                recorded[name].append(np.array(value))
+        price[paths], running[paths] = np.where(active[-1], walk[-1], last), active[-1]
+        reserve[paths], supply[paths], asks[paths] = r, sup, a
+        if not running.any():
+            break
+    return TradingPaths(elapsed, **dict((name, np.column_stack(columns))
+                                        for name, columns in recorded.items()))
+
+
+def test():
+    import copy
+    import random
+    import simulator
+    random.seed(42)
+    mint = simulator.gen_token()
+    bids = simulator.gen_bids(100, 20 * 10**6, 5 * 10**6, 0.25 * 5 * 10**6)
+    sim = simulator.Simulation(mint, bids)
+    sim.verbose = False
+    sim.run_auction(factor=10**12, const=10**3)
+    max_elapsed = mint.auction.elapsed * 1.5
+    final_price = 1.2 * mint.ask
+    reserve = mint.reserve
+
+    def close(a, b):  # reserve_at_price differences lose a few digits
+        assert abs(a - b) <= 1e-6 * max(1, abs(b)), (a, b)
+
+    # one path is run_trading with the same draws
+    paths = trading_paths(mint, 1, max_elapsed, stddev=0.005, final_price=final_price,
+                          seed=1, chunk=100)
+    assert mint.reserve == reserve
+    scalar = copy.deepcopy(mint)
+    rng = np.random.RandomState(1)
+    steps = (max_elapsed - mint.auction.elapsed) / 10
+    median = (final_price / mint.bid) ** (1 / steps)
+    ex_price = mint.auction.final_price
+    k = 0
+    while ex_price < final_price and k < paths.active.shape[1]:
+        ex_price *= rng.normal(median, 0.005)
+        if ex_price > scalar.ask:
+            added_reserve = scalar.curve.reserve_at_price(ex_price) \
+                - scalar.curve.reserve_at_price(scalar.ask)
+            scalar.buy(added_reserve, 'market buyer')
+        assert paths.active[0, k]
+        close(paths.market_price[0, k], ex_price)
+        close(paths.reserve[0, k], scalar.reserve)
+        close(paths.supply[0, k], scalar.token.supply)
+        close(paths.ask[0, k], scalar.ask)
+        close(paths.bid[0, k], scalar.reserve / scalar.token.supply)
+        k += 1
+    assert paths.steps_traded[0] == k
+
+    # many paths, sampled
+    paths = trading_paths(mint, 500, max_elapsed, stddev=0.005, final_price=final_price,
+                          seed=2, every=10)
+    assert paths.reserve.shape[0] == len(paths) == 500
+    assert paths.reserve.shape[1] == len(paths.elapsed)
+    assert (np.diff(paths.reserve, axis=1) >= 0).all()
+    assert (paths.ask >= paths.bid).all()
+    reached = paths.market_price[:, -1] >= final_price
+    assert reached.any() and not paths.active[:, -1].all()
+    summary = paths.summary()
+    assert summary['reserve'][0] <= summary['reserve'][1] <= summary['reserve'][2]
+
+
+if __name__ == '__main__':
+    test()
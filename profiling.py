@@ -0,0 +1,205 @@
+"""
+opt-in instrumentation of the hot paths
+
+enable() replaces the hooked methods with timing wrappers, disable() puts the
+originals back, so the engines run unmodified code while profiling is off.
+every hooked call is counted with its cumulative and own time and
+attributed to the chain of hooked calls it ran in (folded stacks for flamegraph.pl).
+
+    python profiling.py [--folded out.folded] script.py [args]
+
+classes defined by the script itself are not hooked, e.g. profile the traders
+through scheduler.py rather than traders.py.
+"""
+from __future__ import division
+import sys
+import time
+import runpy
+import argparse
+from collections import defaultdict
+
+# subsystem -> (module, class, attributes)
+HOOKS = [
+    ('curve', 'ctoken', 'PriceSupplyCurve',
+     ['price', 'price_at_reserve', 'supply', 'supply_at_price', 'reserve', 'reserve_at_price',
+      'avg_price_at_reserve', 'supply_at_avg_price', 'supply_at_avg_price_and_existing_supply',
+      'avg_price_at_supply', 'reserve_at_avg_price', 'cost', 'issued', 'mktcap',
+      'supply_at_mktcap']),
+    ('token', 'ctoken', 'Token', ['supply', 'issue', 'sell', 'transfer', 'balanceOf']),
+    ('mint', 'ctoken', 'Mint', ['buy', 'sell']),
+    ('auction', 'auction', 'Auction', ['order', 'finalize_auction']),
+    ('exchange', 'exchange', 'Exchange', ['place', 'cancel', 'match', 'buy_market',
+                                          'sell_market']),
+    # one call per iteration of the matching and market order loops, match counts calls
+    ('fills', 'exchange', 'Exchange', ['_record']),
+    ('book', 'exchange', 'BookSide', ['add', 'remove']),
+    ('strategy', 'traders', 'Trader', ['trigger']),
+]
+
+
+class Stats(object):
+
+    def __init__(self):
+        self.calls = defaultdict(int)  # name -> calls
+        self.cumulative = defaultdict(float)  # name -> seconds incl. hooked callees
+        self.own = defaultdict(float)  # name -> seconds excl. hooked callees
+        self.folded = defaultdict(float)  # 'outer;inner' -> own seconds
+        self.subsystem = dict()  # name -> subsystem
+        self._stack = []  # [name, seconds spent in hooked callees]
+
+    def summary(self):
+        "calls, cumulative and own seconds per subsystem"
+        s = dict()
+        for name, calls in self.calls.items():
+            totals = s.setdefault(self.subsystem[name], [0, 0., 0.])
+            totals[0] += calls
+            totals[1] += self.cumulative[name]
+            totals[2] += self.own[name]
+        return s
+
+    def report(self, out=sys.stderr):
+        # cumulative time of nested calls of the same subsystem is counted once per call
+        print >>out, '{:<50} {:>10} {:>12} {:>12}'.format('', 'calls', 'cumulative', 'own')
+        summary = self.summary()
+        for subsystem, (calls, cumulative, own) in sorted(summary.items(),
+                                                          key=lambda i: -i[1][2]):
+            print >>out, '{:<50} {:>10} {:>12.4f} {:>12.4f}'.format(
+                subsystem, calls, cumulative, own)
+            names = [n for n in self.calls if self.subsystem[n] == subsystem]
+            for name in sorted(names, key=lambda n: -self.own[n]):
+                print >>out, '  {:<48} {:>10} {:>12.4f} {:>12.4f}'.format(
+                    name, self.calls[name], self.cumulative[name], self.own[name])
+
+    def write_folded(self, path):
+        "one 'outer;inner microseconds' line per stack, the input of flamegraph.pl"
+        with open(path, 'w') as f:
+            for stack, seconds in sorted(self.folded.items()):
+                f.write('{} {}\n'.format(stack, int(round(seconds * 10**6))))
+
+
+stats = Stats()
+_originals = []  # (owner, attribute, original)
+
+
+def _wrap(fn, name):
+    calls, cumulative, own, folded = stats.calls, stats.cumulative, stats.own, stats.folded
+    stack = stats._stack
+    clock = time.time
+
+    def wrapper(*args, **kargs):
+        frame = [name, 0.]
+        stack.append(frame)
+        started = clock()
+        try:
+            return fn(*args, **kargs)
+        finally:
+            elapsed = clock() - started
+            stack.pop()
+            calls[name] += 1
+            cumulative[name] += elapsed
+            own[name] += elapsed - frame[1]
+            folded[';'.join(f[0] for f in stack + [frame])] += elapsed - frame[1]
+            if stack:
+                stack[-1][1] += elapsed
+    wrapper.__name__ = fn.__name__
+    wrapper.__doc__ = fn.__doc__
+    return wrapper
+
+
+def _hook(owner, attribute, subsystem, name):
+    original = owner.__dict__[attribute]
+    stats.subsystem[name] = subsystem
+    if isinstance(original, property):
+        wrapped = property(_wrap(original.fget, name), original.fset, original.fdel,
+                           original.__doc__)
+    else:
+        wrapped = _wrap(original, name)
+    _originals.append((owner, attribute, original))
+    setattr(owner, attribute, wrapped)
+
+
+def enable():
+    if _originals:
+        return
+    for subsystem, module, cls, attributes in HOOKS:
+        owner = getattr(__import__(module), cls)
+        for attribute in attributes:
+            _hook(owner, attribute, subsystem, '{}.{}'.format(cls, attribute))
+    # every strategy separately
+    from traders import StrategyBase
+    todo = StrategyBase.__subclasses__()
+    while todo:
+        cls = todo.pop()
+        todo.extend(cls.__subclasses__())
+        if '_trigger' in cls.__dict__:
+            _hook(cls, '_trigger', 'strategy', '{}._trigger'.format(cls.__name__))
+
+
+def disable():
+    while _originals:
+        owner, attribute, original = _originals.pop()
+        setattr(owner, attribute, original)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--folded', help='write folded stacks for flamegraph.pl')
+    parser.add_argument('script')
+    parser.add_argument('args', nargs=argparse.REMAINDER)
+    args = parser.parse_args(argv)
+
+    sys.argv = [args.script] + args.args
+    sys.path.insert(0, '.')
+    enable()
+    try:
+        runpy.run_path(args.script, run_name='__main__')
+    finally:
+        disable()
+        stats.report()
+        if args.folded:
+            stats.write_folded(args.folded)
+
+
+def test():
+    from ctoken import PriceSupplyCurve, Token
+    curve = PriceSupplyCurve(factor=0.000001, base_price=1)
+    original = PriceSupplyCurve.__dict__['supply']
+    enable()
+    try:
+        assert PriceSupplyCurve.__dict__['supply'] is not original
+        curve.issued(1000, 500)
+        token = Token()
+        token.issue(10, 'a')
+        assert token.supply == 10
+    finally:
+        disable()
+    assert PriceSupplyCurve.__dict__['supply'] is original
+    assert isinstance(Token.__dict__['supply'], property)
+    assert stats.calls['PriceSupplyCurve.issued'] == 1
+    assert stats.calls['PriceSupplyCurve.reserve'] >= 1
+    assert stats.calls['Token.supply'] == 1
+    assert 'PriceSupplyCurve.issued;PriceSupplyCurve.reserve' in stats.folded
+    summary = stats.summary()
+    assert summary['curve'][0] == sum(c for n, c in stats.calls.items()
+                                      if n.startswith('PriceSupplyCurve.'))
+    curve.issued(1000, 500)  # disabled, not counted
+    assert stats.calls['PriceSupplyCurve.issued'] == 1
+
+    # a sell order matching three bids is one match call with three fills
+    from exchange import Exchange, BuyOrder, SellOrder
+    ex = Exchange()
+    enable()
+    try:
+        for price in [99, 100, 101]:
+            ex.place(BuyOrder(price, 1, callback=lambda *args: None))
+        matches = stats.calls['Exchange.match']
+        ex.place(SellOrder(90, 3, callback=lambda *args: None))
+    finally:
+        disable()
+    assert stats.calls['Exchange.match'] == matches + 1
+    assert stats.calls['Exchange._record'] == len(ex.ticker) == 3
+    assert stats.summary()['fills'][0] == 3
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,131 @@
+"""
+chart rendering for draw and simple_draw
+
+series are downsampled to max_points with largest-triangle-three-buckets,
+which keeps the peaks and dips a plain stride would drop.
+charts are written to a standalone html file (plotly.offline, with plotly.js embedded)
+or a png (matplotlib), neither needs network access or credentials.
+the chart is only uploaded to the online plotly service when asked to (online=True).
+"""
+from __future__ import division
+import os
+import numpy as np
+
+OUTPUT_DIR = 'output'  # default directory of the charts, relative to the working directory
+
+
+def lttb(x, y, threshold):
+    "largest-triangle-three-buckets downsampling to threshold points"
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    size = len(x)
+    if threshold >= size or threshold < 3:
+        return x, y
+    every = (size - 2) / (threshold - 2)
+    selected = np.empty(threshold, dtype=int)
+    selected[0], selected[-1] = 0, size - 1
+    a = 0
+    for i in range(threshold - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, size)
+        if next_end > end:
+            avg_x, avg_y = x[end:next_end].mean(), y[end:next_end].mean()
+        else:
+            avg_x, avg_y = x[-1], y[-1]
+        # twice the area of the triangles between the last selected point,
+        # the candidates in this bucket and the average of the next bucket
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) -
+                      (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(area.argmax())
+        selected[i + 1] = a
+    return x[selected], y[selected]
+
+
+def plot(sections, title, filename=None, online_name=None, max_points=2000, online=False,
+         output_dir=None):
+    """
+    sections: ordered mapping of subplot titles to lists of (name, xs, ys)
+    filename: *.png or *.html, defaults to <online_name>.html in output_dir (OUTPUT_DIR)
+    online: upload to plotly as online_name instead, needs plotly credentials
+    """
+    downsampled = [(section, [(name,) + lttb(xs, ys, max_points) for name, xs, ys in series])
+                   for section, series in sections.items()]
+    if online:
+        return _plot_plotly(downsampled, title, None, online_name)
+    if filename is None:
+        output_dir = output_dir or OUTPUT_DIR
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+        filename = os.path.join(output_dir, '{}.html'.format(online_name or 'chart'))
+    if filename.endswith('.png'):
+        return _plot_png(downsampled, title, filename)
+    return _plot_plotly(downsampled, title, filename, online_name)
+
+
+def _plot_plotly(sections, title, filename, online_name):
+    import plotly.graph_objs as go
+    from plotly import tools
+
+    fig = tools.make_subplots(rows=len(sections), cols=1,
+                              subplot_titles=[s for s, _ in sections], print_grid=False)
+    for i, (section, series) in enumerate(sections):
+        for name, xs, ys in series:
+            fig.append_trace(go.Scatter(x=xs, y=ys, name=name), i + 1, 1)
+    fig['layout'].update(title=title)
+
+    if filename is None:
+        import plotly.plotly as py
+        return py.plot(fig, filename=online_name)
+    import plotly.offline
+    return plotly.offline.plot(fig, filename=filename, auto_open=False)
+
+
+def _plot_png(sections, title, filename):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    fig, axes = plt.subplots(len(sections), 1, sharex=True, squeeze=False,
+                             figsize=(12, 4 * len(sections)))
+    for ax, (section, series) in zip(axes[:, 0], sections):
+        for name, xs, ys in series:
+            ax.plot(xs, ys, label=name, linewidth=1)
+        ax.set_title(section)
+        ax.legend(loc='best', fontsize='small')
+    fig.suptitle(title)
+    fig.savefig(filename)
+    plt.close(fig)
+    return filename
+
+
+def test():
+    x = np.arange(10000)
+    y = np.sin(x / 100.) + (x == 5000) * 10  # a spike a stride would miss
+    xs, ys = lttb(x, y, 500)
+    assert len(xs) == 500
+    assert xs[0] == 0 and xs[-1] == 9999
+    assert all(np.diff(xs) > 0)
+    assert ys.max() == y.max()
+    xs, ys = lttb(x[:100], y[:100], 500)
+    assert len(xs) == 100
+
+    # without a filename the chart is written to the output directory, not uploaded
+    import shutil
+    import tempfile
+    try:
+        import plotly.offline
+    except ImportError:
+        return
+    tmp = tempfile.mkdtemp()
+    try:
+        output_dir = os.path.join(tmp, 'charts')
+        plot({'sine': [('y', x, y)]}, title='test', online_name='chart_test',
+             output_dir=output_dir)
+        assert os.listdir(output_dir) == ['chart_test.html']
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,122 @@
+"""
+discrete event scheduler for traders
+
+instead of triggering every trader on every interval, traders are kept in a
+priority queue by the time their strategy wants to act next
+(StrategyBase.next_wakeup). strategies with wake_on_tick sleep until the next
+trade on the exchange. the exchange time advances from event to event.
+"""
+from __future__ import division
+import heapq
+import itertools
+from collections import OrderedDict
+from exchange import NotAvailable
+
+
+class Scheduler(object):
+
+    def __init__(self, exchange, quantum=None):
+        """
+        quantum rounds wake-up times up to multiples of it,
+        e.g. the interval of a polling loop to reproduce its timing
+        """
+        self.ex = exchange
+        self.quantum = quantum
+        self.triggers = 0
+        self._queue = []  # (time, seq, trader)
+        self._seq = itertools.count()
+        self._scheduled = dict()  # trader -> queued time, older queue entries are stale
+        self._sleeping = OrderedDict()  # traders waiting for the next trade
+        exchange.events.subscribe('tick', self._on_tick)
+
+    def add(self, trader, time=None):
+        self.schedule(trader, self.ex.time if time is None else time)
+
+    def schedule(self, trader, time):
+        if self.quantum:
+            time = -(-time // self.quantum) * self.quantum
+        queued = self._scheduled.get(trader)
+        if queued is not None and queued <= time:
+            return
+        self._scheduled[trader] = time
+        heapq.heappush(self._queue, (time, next(self._seq), trader))
+
+    def _on_tick(self, tick):
+        sleeping, self._sleeping = self._sleeping, OrderedDict()
+        for trader in sleeping:
+            self.schedule(trader, self.ex.time)
+
+    def run(self, end_time):
+        "triggers the traders in time order up to end_time"
+        queue = self._queue
+        while queue and queue[0][0] <= end_time:
+            time, _, trader = heapq.heappop(queue)
+            if self._scheduled.get(trader) != time:
+                continue  # rescheduled earlier
+            del self._scheduled[trader]
+            if time > self.ex.time:
+                self.ex.update_time(time)
+            try:
+                trader.trigger()
+            except NotAvailable:  # no bid or ask yet, the strategy retries at its next wakeup
+                pass
+            self.triggers += 1
+            strategy = trader.strategy
+            wakeup = strategy.next_wakeup(trader)
+            if wakeup is not None:
+                assert wakeup > time, (strategy, wakeup, time)
+                self.schedule(trader, wakeup)
+            if strategy.wake_on_tick:
+                self._sleeping[trader] = True
+
+
+def test():
+    import random
+    from exchange import Exchange, BuyOrder
+    from traders import Trader, MarketMaker, AverageIn, AverageOut, BuyAndHold
+
+    def setup():
+        random.seed(42)
+        exchange = Exchange()
+        exchange.time = 1
+        traders = [Trader(exchange, 10**6, 10**5, MarketMaker(100, mu=1, sigma=0.01))]
+        for strategy in [AverageIn(), AverageIn(), AverageOut(), BuyAndHold(), BuyAndHold()]:
+            traders.append(Trader(exchange, 10**4, 100, strategy))
+        return exchange, traders
+
+    # polling loop
+    exchange, traders = setup()
+    polled = 0
+    while exchange.time < 3600:
+        exchange.time += 10
+        for t in traders:
+            t.trigger()
+            polled += 1
+
+    exchange, traders = setup()
+    total_tokens = sum(t.tokens for t in traders)
+    scheduler = Scheduler(exchange, quantum=10)
+    for t in traders:
+        scheduler.add(t, exchange.time + 10)
+    scheduler.run(3601)
+    assert scheduler.triggers < polled / 2, (scheduler.triggers, polled)
+    assert abs(sum(t.tokens for t in traders) - total_tokens) < 1e-6
+    averaging = [t for t in traders if isinstance(t.strategy, AverageIn)]
+    assert all(t.strategy.intervals == [] for t in averaging)
+
+    # traders finding no bid or ask keep their wakeups and slices
+    exchange = Exchange()
+    exchange.time = 1
+    trader = Trader(exchange, 10**4, 100, AverageOut(period=100, steps=10))
+    scheduler = Scheduler(exchange)
+    scheduler.add(trader)
+    scheduler.run(1000)
+    assert scheduler.triggers > 10 and len(trader.strategy.intervals) == 10
+    buyer = Trader(exchange, 10**6, 0)
+    buyer.place(BuyOrder(1, 1000, callback=buyer.callback))
+    scheduler.run(2000)
+    assert trader.strategy.intervals == [] and trader.reserved_tokens == 100
+
+
+if __name__ == '__main__':
+    test()
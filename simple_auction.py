@@ -1,19 +1,7 @@
 from __future__ import division
-
-
-class Token(object):
-
-    def __init__(self):
-        self.accounts = dict()
-
-    @property
-    def supply(self):
-        return sum(self.accounts.values())
-
-    def issue(self, num, recipient):
-        if recipient not in self.accounts:
-            self.accounts[recipient] = 0
-        self.accounts[recipient] += num
+from ctoken import Claims
+from auction import Orders
+from events import EventSink
 
 
 class Auction(object):
@@ -28,8 +16,12 @@ class Auction(object):
     """
     supply = 10**6
 
-    def __init__(self, token, factor, const, pre_auction_reserve=0):
+    def __init__(self, token, factor, const, pre_auction_reserve=0, events=None,
+                 lazy_claims=False):
         self.token = token
+        self.events = events or EventSink()
+        # credit the bidders only when they access their balance or claim
+        self.lazy_claims = lazy_claims
         # factor and const determin the initial price and its rate of reduction over time
         self.factor = factor
         self.const = const
@@ -42,11 +34,15 @@ class Auction(object):
         # the number of tokens that are auctioned
         self.offered_supply = self.supply - self.prealloc
         # track the amounts received
-        self.value_by_buyer = dict()
+        self.orders = Orders()
         # the elapsed time
         self.elapsed = 0
         self.closing_price = 0
 
+    @property
+    def value_by_buyer(self):
+        return dict(self.orders.items())
+
     @property
     def price(self):
         "price after elapsed time"
@@ -83,15 +79,23 @@ class Auction(object):
         """
         assert not self.closing_price
         value = min(value, self.missing_reserve_to_end_auction)
-        self.value_by_buyer[recipient] = self.value_by_buyer.get(recipient, 0) + value
+        self.orders.add(recipient, value)
         self.reserve += value
+        ev = self.events.auction_order
+        if ev:
+            ev(recipient, value, self.elapsed)
         if self.missing_reserve_to_end_auction == 0:  # this call ended the auction
             self.finalize_auction()
 
     def finalize_auction(self):
         "all bidders get tokens at the same current price"
-        print 'finalizing auction at price:{}'.format(self.price)
         self.closing_price = self.price
-        for recipient, value in self.value_by_buyer.items():
-            num_issued = self.offered_supply * value / self.reserve
-            self.token.issue(num_issued, recipient)
+        if self.lazy_claims:
+            self.token.defer(Claims(self.orders, self.offered_supply, self.reserve))
+        else:
+            self.token.issue_many(self.orders.shares(self.offered_supply, self.reserve),
+                                  self.orders.recipients)
+        ev = self.events.auction_finalized
+        if ev:
+            ev(self.elapsed, self.closing_price, self.reserve / self.offered_supply,
+               self.reserve, self.token.supply)
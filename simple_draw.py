@@ -1,18 +1,21 @@
 # Learn about API authentication here: https://plot.ly/python/getting-started
 # Find your api_key here: https://plot.ly/settings/api
 import collections
-import plotly.plotly as py
-import plotly.graph_objs as go
-from plotly import tools
+import render
 
 
-def draw(ticks):
+def draw(ticks, filename=None, max_points=2000, online=False, output_dir=None):
+    """
+    filename: *.html or *.png, rendered locally, defaults to continuoustoken6.html
+    in output_dir (render.OUTPUT_DIR). online uploads the chart to plotly instead
+    """
 
-    ticks_r = [t for t in ticks if t['Raised_Reserve'] > 0]
-    ticks = ticks[-int(len(ticks_r) * 1.1):]
+    num_reserve = int(sum(1 for r in ticks['Raised_Reserve'] if r > 0) * 1.1)
+    start = max(0, len(ticks) - num_reserve) if num_reserve else 0
 
     def tdata(key):
-        return [(t['time'], t[key]) for t in ticks if key in t]
+        return [(t, v) for t, v in zip(ticks['time'][start:], ticks[key][start:])
+                if v == v]  # skip missing
 
     traces1 = []
     traces2 = []
@@ -21,8 +24,7 @@ def draw(ticks):
         d = tdata(key)
         assert d
         name = key.replace('_', ' ')
-        s = go.Scatter(x=[_[0] for _ in d], y=[_[1] for _ in d], name=name)
-        t.append(s)
+        t.append((name, [_[0] for _ in d], [_[1] for _ in d]))
 
     def chart2(key):
         chart(key, traces2)
@@ -38,17 +40,11 @@ def draw(ticks):
     chart2('Valuation_At_Price')
 
     ######
-    SHOW = collections.OrderedDict(
-        Prices=traces1,
-        Valuation=traces2,
-    )
-
-    fig = tools.make_subplots(rows=len(SHOW), cols=1,
-                              subplot_titles=SHOW.keys())
-
-    for i, traces in enumerate(SHOW.values()):
-        for t in traces:
-            fig.append_trace(t, i + 1, 1)
-
-    fig['layout'].update(title='Reverse Auction')
-    plot_url = py.plot(fig, filename='continuoustoken6')
+    SHOW = collections.OrderedDict([
+        ('Prices', traces1),
+        ('Valuation', traces2),
+    ])
+
+    return render.plot(SHOW, title='Reverse Auction', filename=filename,
+                       online_name='continuoustoken6', max_points=max_points, online=online,
+                       output_dir=output_dir)
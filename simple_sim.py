@@ -1,9 +1,13 @@
 from __future__ import division
+import sys
 import random
 from operator import attrgetter
 from collections import namedtuple
-from simple_auction import Auction, Token
-from simple_draw import draw
+from ctoken import Token
+from simple_auction import Auction
+from events import console_writer
+from ticks import TickStore
+from simulator import BidArrays, gen_bid_arrays
 
 Bid = namedtuple('Bid', 'value, valuation')
 
@@ -14,9 +18,12 @@ class Simulation(object):
         self.auction = auction
         self.bids = bids
         self.step = 5 * 60  # 5 minutes
-        self.ticker = []
+        self.ticker = TickStore()
+        self.verbose = True
 
     def report(self):
+        if not self.verbose:
+            return
         s = '{} ask:{:.2f} bid:{:.2f} mktcap:{:,.0f} valuation:{:,.0f} reserve:{:,.0f}'
         print s.format(self.auction.elapsed,
                        self.auction.price,
@@ -38,13 +45,17 @@ class Simulation(object):
         self.ticker.append(d)
 
     def run_auction(self):
-        print 'starting price:{:,.0f} starting mktcap:{:,.0f}'.format(
-            self.auction.price, self.auction.mktcap_at_price)
-        while not self.auction.closing_price and self.bids:
+        if self.verbose:
+            print 'starting price:{:,.0f} starting mktcap:{:,.0f}'.format(
+                self.auction.price, self.auction.mktcap_at_price)
+        bids = self.bids
+        n = 0  # bids ordered, dropped from self.bids at the end
+        while not self.auction.closing_price and n < len(bids):
             # self.report()
             self.auction.elapsed += self.step
-            while self.bids and self.bids[0].valuation > self.auction.valuation_at_price:
-                i = self.bids.pop(0)
+            while n < len(bids) and bids[n].valuation > self.auction.valuation_at_price:
+                i = bids[n]
+                n += 1
                 self.auction.order(i, i.value)
                 if self.auction.closing_price:
                     self.report()
@@ -53,11 +64,21 @@ class Simulation(object):
             self.tick()
             if self.auction.closing_price:
                 break
+        del bids[:n]
         assert self.auction.closing_price, 'increase the total order amount'
         assert self.auction.token.supply > 0
 
+    def run_auction_arrays(self, values, valuations):
+        """
+        run_auction with the bids read from value and valuation arrays,
+        sorted by valuation, highest first (see gen_bid_arrays)
+        """
+        self.bids = BidArrays(values, valuations)
+        self.run_auction()
+
 
 def gen_bids(num_bidders, total_purchase_amount, median_valuation, std_deviation):
+    "bids from the random module, reproducible with random.seed. gen_bid_arrays for many bidders"
     bids = []
     for i in range(num_bidders):
         i = Bid(value=random.paretovariate(2),
@@ -71,7 +92,8 @@ def gen_bids(num_bidders, total_purchase_amount, median_valuation, std_deviation
     return bids
 
 
-def main():
+def main(online=False):
+    "runs the simulation and charts it to an html file, online uploads the chart to plotly"
     random.seed(42)
 
     num_bidders = 3000
@@ -84,6 +106,7 @@ def main():
     token = Token()
     token.issue(0.25 * Auction.supply, 'prealloc')  # 25% prealloc
     auction = Auction(token, factor=30 * 10**6, const=10**3, pre_auction_reserve=0)
+    console_writer().attach(auction.events, 'auction_finalized')
     sim = Simulation(auction, bids[:])
 
     print 'Running Auction'
@@ -97,7 +120,8 @@ def main():
     print 'not ordered', len(sim.bids)
 
     print 'visualizing {} ticks'.format(len(sim.ticker))
-    draw(sim.ticker)
+    from simple_draw import draw
+    print 'chart', draw(sim.ticker, online=online)
 
 if __name__ == '__main__':
-    main()
+    main(online='--online' in sys.argv[1:])
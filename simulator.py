@@ -30,12 +30,14 @@ Parameters:
     - num bidders
 """
 from __future__ import division
+import sys
 import random
 from operator import attrgetter
 from collections import namedtuple
 from ctoken import Mint, PriceSupplyCurve, Beneficiary
 from auction import Auction
-from draw import draw
+from events import console_writer
+from ticks import TickStore
 
 Bid = namedtuple('Bid', 'value, valuation')
 
@@ -47,9 +49,12 @@ class Simulation(object):
         self.auction = mint.auction
         self.bids = bids
         self.step = 10
-        self.ticker = []
+        self.ticker = TickStore()
+        self.verbose = True
 
     def report(self):
+        if not self.verbose:
+            return
         a = 'A' if self.mint.isauction else 'T'
         s = '{}{} ask:{:.2f} bid:{:.2f} maxmktcap:{:,.0f}  maxvaluation:{:,.0f} valuation:{:,.0f} ' +\
             'reserve:{:,.0f} supply:{:,.0f}'
@@ -102,8 +107,9 @@ class Simulation(object):
 
     def run_auction(self, factor, const):
         self.auction.start(factor, const)
-        print 'starting price:{} starting mktcap:{}'.format(
-            self.auction.price, self.auction.max_mktcap)
+        if self.verbose:
+            print 'starting price:{} starting mktcap:{}'.format(
+                self.auction.price, self.auction.max_mktcap)
         while not self.auction.ended and self.bids:
             # self.report()
             self.auction.elapsed += self.step
@@ -120,12 +126,71 @@ class Simulation(object):
         assert self.auction.ended, 'increase the total order amount'
         assert self.mint.token.supply > 0
 
+    def run_auction_events(self, factor, const):
+        """
+        same outcome as run_auction, but jumps from bid to bid instead of stepping.
+        the time at which the next bid becomes eligible is solved for and rounded up
+        to the next step, bids eligible on the current step are placed on it.
+        as in run_auction, the auction ends with the order which completes the reserve.
+        ticks are only taken on steps with orders.
+        if the bids run out first, it ends once the collected reserve suffices
+        """
+        self._run_events(factor, const, lambda i, bid: bid)
+
+    def run_auction_arrays(self, factor, const, values, valuations):
+        """
+        run_auction_events with the bids read from value and valuation arrays,
+        sorted by valuation, highest first (see gen_bid_arrays).
+        bidders are identified by their index in the arrays
+        """
+        self.bids = BidArrays(values, valuations)
+        self._run_events(factor, const, lambda i, bid: i)
+
+    def _run_events(self, factor, const, recipient):
+        auction = self.auction
+        auction.start(factor, const)
+        if self.verbose:
+            print 'starting price:{} starting mktcap:{}'.format(
+                auction.price, auction.max_mktcap)
+        i = 0
+        while not auction.ended and i < len(self.bids):
+            bid = self.bids[i]
+            # eligible once max_valuation dropped below the valuation, as in run_auction
+            if not (auction.elapsed and bid.valuation > auction.max_valuation):
+                elapsed = self._next_step(auction.elapsed_at_max_valuation(bid.valuation))
+                if elapsed == float('inf'):
+                    break
+                if elapsed > auction.elapsed:
+                    if auction.elapsed:
+                        self.tick()  # one tick per step with orders
+                    auction.elapsed = elapsed
+            auction.order(recipient(i, bid), bid.value)
+            i += 1
+            self.report()
+        if not auction.ended:
+            assert auction.reserve, 'increase the total order amount'
+            self.tick()
+            auction.elapsed = self._next_step(auction.elapsed_at_end())
+            auction.finalize_auction()
+            self.report()
+        self.tick()
+        del self.bids[:i]
+        assert self.mint.token.supply > 0
+
+    def _next_step(self, elapsed):
+        "the first step after elapsed, but not before the current one"
+        if elapsed == float('inf'):
+            return elapsed
+        elapsed = (int(elapsed // self.step) + 1) * self.step
+        return max(elapsed, self.auction.elapsed or self.step)
+
     def run_trading(self, max_elapsed, stddev, final_price):
         mint = self.mint
         assert mint.token.supply > 0
         assert not mint.isauction
         ex_price = mint.auction.final_price
-        print 'trading start price', ex_price
+        if self.verbose:
+            print 'trading start price', ex_price
         start = mint.auction.elapsed
         steps = (max_elapsed - start) / self.step
         period_factor = final_price / mint.bid
@@ -147,6 +212,13 @@ class Simulation(object):
             #     final_price_reached = True
             #     print 'price target reached'
 
+    def run_trading_paths(self, max_elapsed, stddev, final_price, num_paths, seed=None,
+                          every=1):
+        "run_trading for num_paths walks at once without changing the mint, see paths.py"
+        from paths import trading_paths
+        return trading_paths(self.mint, num_paths, max_elapsed, stddev, final_price,
+                             step=self.step, seed=seed, every=every)
+
 
 def gen_bids(num_bidders, total_purchase_amount, median_valuation, std_deviation):
     bids = []
@@ -162,6 +234,52 @@ def gen_bids(num_bidders, total_purchase_amount, median_valuation, std_deviation
     return bids
 
 
+class BidArrays(object):
+    """
+    bids backed by value and valuation arrays.
+    only the placed bids are turned into Bid tuples, deleting leading bids is O(1)
+    """
+
+    def __init__(self, values, valuations):
+        assert len(values) == len(valuations)
+        self.values = values
+        self.valuations = valuations
+        self._start = 0
+
+    def __len__(self):
+        return len(self.values) - self._start
+
+    def __getitem__(self, i):
+        i += self._start
+        return Bid(float(self.values[i]), float(self.valuations[i]))
+
+    def __delitem__(self, s):
+        assert isinstance(s, slice) and not s.start and s.step is None
+        self._start = min(len(self.values), self._start + s.stop)
+
+    def __delslice__(self, i, j):
+        self.__delitem__(slice(i, j))
+
+
+def gen_bid_arrays(num_bidders, total_purchase_amount, median_valuation, std_deviation,
+                   seed=None):
+    """
+    same distributions as gen_bids, returns value and valuation arrays
+    sorted by valuation, highest first
+    """
+    import numpy
+    rng = numpy.random.RandomState(seed)
+    values = rng.pareto(2, num_bidders)
+    values += 1  # numpy's pareto is shifted by one against paretovariate
+    values *= total_purchase_amount / values.sum()
+    valuations = rng.normal(median_valuation, std_deviation, num_bidders)
+    order = numpy.argsort(valuations)[::-1]
+    values = values[order]
+    valuations = valuations[order]
+    assert valuations[0] > valuations[-1]
+    return values, valuations
+
+
 def gen_token():
     curve = PriceSupplyCurve(factor=0.000001, base_price=1)
     auction = Auction()
@@ -170,9 +288,11 @@ def gen_token():
     return ct
 
 
-def main():
+def main(online=False):
+    "runs the simulation and charts it to an html file, online uploads the chart to plotly"
     random.seed(42)
     mint = gen_token()
+    console_writer().attach(mint.auction.events, 'auction_finalized')
     num_bidders = 300
     total_purchase_amount = 20 * 10**6
     median_valuation = 5 * 10**6
@@ -212,7 +332,34 @@ def main():
     print 'not ordered', len(sim.bids)
 
     print 'visualizing {} ticks'.format(len(sim.ticker))
-    draw(sim.ticker)
+    from draw import draw
+    print 'chart', draw(sim.ticker, online=online)
+
+
+def test():
+    import copy
+    for seed, num_bidders in [(42, 300), (1, 100)]:
+        random.seed(seed)
+        mint = gen_token()
+        bids = gen_bids(num_bidders, 20 * 10**6, 5 * 10**6, 0.25 * 5 * 10**6)
+        results = []
+        ticks = []
+        for run in [Simulation.run_auction, Simulation.run_auction_events]:
+            sim = Simulation(copy.deepcopy(mint), bids[:])
+            sim.verbose = False
+            run(sim, factor=10**12, const=10**3)
+            auction = sim.auction
+            results.append((auction.final_price, auction.elapsed, len(sim.bids),
+                            sim.mint.token.supply, sim.mint.reserve))
+            ticker = sim.ticker
+            ticks.append(zip(ticker['time'], ticker['Supply'], ticker['Reserve']))
+        stepped, events = results
+        assert stepped == events, (seed, stepped, events)
+        # the event runner ticks once per step with orders, as run_auction does on those steps
+        stepped, events = ticks
+        assert len(set(t[0] for t in events)) == len(events)
+        assert set(events) <= set(stepped), (seed, sorted(set(events) - set(stepped))[:3])
+
 
 if __name__ == '__main__':
-    main()
+    main(online='--online' in sys.argv[1:])
@@ -0,0 +1,214 @@
+"""
+Monte Carlo sweep over the auction and trading simulation
+
+every scenario is a full simulator run (gen_bids, auction, trading) for one
+combination of parameters and one seed. scenarios run in a process pool,
+each finished run is appended as a json line to the output file.
+rerunning a sweep with the same output file skips the scenarios found there.
+
+    python sweep.py results.jsonl --seeds 1000 --grid '{"num_bidders": [100, 300, 1000]}'
+"""
+from __future__ import division
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import itertools
+import multiprocessing
+from ctoken import Mint, PriceSupplyCurve, Beneficiary
+from auction import Auction
+from simulator import Simulation, gen_bids
+
+DEFAULTS = dict(
+    num_bidders=300,
+    total_purchase_amount=20 * 10**6,
+    median_valuation=5 * 10**6,
+    std_deviation=0.25,  # fraction of median_valuation
+    auction_factor=10**12,
+    auction_const=10**3,
+    curve_factor=0.000001,
+    base_price=1,
+    issuance_fraction=0.2,
+    trading_stddev=0.005,
+    final_price=1.2,  # multiple of the ask after the auction
+    max_elapsed=3,  # multiple of the auction duration
+)
+
+
+def scenario_key(params):
+    return json.dumps(params, sort_keys=True)
+
+
+def summarize(sim):
+    "the outcome of a simulation run"
+    mint, auction = sim.mint, sim.auction
+    return dict(
+        auction_final_price=auction.final_price,
+        raised_reserve=auction.reserve,
+        unfilled_bids=len(sim.bids),
+        elapsed=auction.elapsed,
+        reserve=mint.reserve,
+        supply=mint.token.supply,
+        ask=mint.ask,
+        bid=mint.bid,
+        mktcap=mint.mktcap,
+        valuation=mint.valuation,
+        ticks=len(sim.ticker),
+    )
+
+
+def gen_simulation(p):
+    "a Simulation for the parameters p (see DEFAULTS), seeds random with p['seed']"
+    random.seed(p['seed'])
+    curve = PriceSupplyCurve(factor=p['curve_factor'], base_price=p['base_price'])
+    mint = Mint(curve, Beneficiary(p['issuance_fraction']), Auction())
+    bids = gen_bids(p['num_bidders'], p['total_purchase_amount'], p['median_valuation'],
+                    p['std_deviation'] * p['median_valuation'])
+    sim = Simulation(mint, bids)
+    sim.verbose = False
+    return sim
+
+
+def run_trading(sim, p):
+    "the trading phase for the parameters p, after the auction"
+    mint = sim.mint
+    sim.run_trading(mint.auction.elapsed * p['max_elapsed'], stddev=p['trading_stddev'],
+                    final_price=p['final_price'] * mint.ask)
+
+
+def error_message(e):
+    "the type and message of an exception failing a scenario"
+    message = str(e)
+    return '{}: {}'.format(type(e).__name__, message) if message else type(e).__name__
+
+
+def summarize_run(result, sim):
+    "adds summarize(sim) to result, the state of a failed run might not summarize"
+    try:
+        result.update(summarize(sim))
+    except Exception as e:
+        result.setdefault('error', error_message(e))
+
+
+def run_scenario(params):
+    """
+    the result row of the scenario, a failing scenario records the error
+    instead of failing the sweep
+    """
+    p = dict(DEFAULTS)
+    p.update(params)
+    started = time.time()
+    result = dict(key=scenario_key(params), params=params)
+    sim = None
+    try:
+        sim = gen_simulation(p)
+        sim.run_auction_events(factor=p['auction_factor'], const=p['auction_const'])
+        result['auction_elapsed'] = sim.auction.elapsed
+        run_trading(sim, p)
+    except Exception as e:
+        result['error'] = error_message(e)
+    if sim is not None:
+        summarize_run(result, sim)
+    result['runtime'] = time.time() - started
+    return result
+
+
+def expand(grid, seeds):
+    "every combination of the grid values, each with every seed"
+    keys = sorted(grid)
+    for values in itertools.product(*[grid[k] for k in keys]):
+        for seed in seeds:
+            params = dict(zip(keys, values))
+            params['seed'] = seed
+            yield params
+
+
+def completed(path):
+    "keys of the scenarios in path, a line cut off by an interrupted sweep is dropped"
+    if not os.path.exists(path):
+        return set()
+    with open(path, 'rb+') as f:
+        data = f.read()
+        end = data.rfind('\n') + 1
+        if end < len(data):
+            f.truncate(end)
+    return set(json.loads(line)['key'] for line in data[:end].splitlines() if line)
+
+
+def run_sweep(scenarios, path, processes=None):
+    """
+    runs the scenarios not yet found in path, returns the number of runs
+    """
+    done = completed(path)
+    todo = [s for s in scenarios if scenario_key(s) not in done]
+    if not todo:
+        return 0
+    pool = multiprocessing.Pool(processes)
+    try:
+        with open(path, 'ab') as f:
+            for i, result in enumerate(pool.imap_unordered(run_scenario, todo)):
+                f.write(json.dumps(result) + '\n')
+                f.flush()
+                print '{}/{} seed:{} runtime:{:.2f}'.format(
+                    i + 1, len(todo), result['params']['seed'], result['runtime'])
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return len(todo)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('output', help='json lines file, appended to and resumed from')
+    parser.add_argument('--seeds', type=int, default=100, help='seeds per parameter set')
+    parser.add_argument('--seed-offset', type=int, default=0)
+    parser.add_argument('--grid', default='{}',
+                        help='json object or file mapping parameters to lists of values')
+    parser.add_argument('--processes', type=int, default=None, help='defaults to all cores')
+    args = parser.parse_args(argv)
+
+    grid = args.grid
+    if os.path.exists(grid):
+        grid = open(grid).read()
+    grid = json.loads(grid)
+    unknown = set(grid) - set(DEFAULTS)
+    if unknown:
+        parser.error('unknown parameters: {}'.format(', '.join(sorted(unknown))))
+    seeds = range(args.seed_offset, args.seed_offset + args.seeds)
+    num = run_sweep(list(expand(grid, seeds)), args.output, args.processes)
+    print 'ran {} scenarios'.format(num)
+
+
+def test():
+    import tempfile
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        scenarios = list(expand(dict(num_bidders=[50, 100]), seeds=range(2)))
+        assert len(scenarios) == 4
+        assert run_sweep(scenarios[:3], path, processes=2) == 3
+        # interrupted while writing
+        with open(path, 'ab') as f:
+            f.write('{"key": ')
+        assert run_sweep(scenarios, path, processes=2) == 1
+        results = [json.loads(l) for l in open(path)]
+        assert sorted(r['key'] for r in results) == sorted(scenario_key(s) for s in scenarios)
+        # deterministic per seed
+        again = run_scenario(scenarios[0])
+        first = [r for r in results if r['key'] == again['key']][0]
+        assert first['reserve'] == again['reserve'] and 'error' not in first
+        # failing scenarios are recorded
+        assert run_scenario(dict(seed=1, num_bidders=0))['error'].startswith('ZeroDivisionError')
+        result = run_scenario(dict(seed=1, issuance_fraction=1.5))
+        assert result['error'].startswith('AssertionError') and 'reserve' not in result
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,7 +1,8 @@
 from __future__ import division
 
-from ctoken import Beneficiary, Auction
-from ctoken import PriceSupplyCurve, Mint, xassert
+from ctoken import Beneficiary
+from auction import Auction
+from ctoken import PriceSupplyCurve, Mint, Token, xassert
 
 
 def test_curve():
@@ -73,8 +74,200 @@ def test_avg_price():
     # print s, s2, avg_price2, target, r, missing
 
 
+def test_ledger():
+    token = Token()
+    token.issue(100, 'a')
+    token.issue(50, 'b')
+    assert token.supply == 150
+    assert token.account_id('a') == 0 and token.account_id('b') == 1
+    token.transfer('a', 'c', 30)
+    assert token.balanceOf('a') == 70 and token.balanceOf('c') == 30
+    assert token.balanceOf('unknown') == 0
+    assert token.supply == 150
+    snapshot = token.snapshot()
+    token.sell(70, 'a')
+    token.issue(10, 'd')
+    assert token.supply == 90
+    assert token.accounts['d'] == 10
+    token.restore(snapshot)
+    assert token.supply == 150
+    assert token.balanceOf('a') == 70
+    assert 'd' not in token.accounts
+    assert sorted(token.accounts.values()) == [30, 50, 70]
+    # an earlier snapshot, then a later one
+    token = Token()
+    token.issue(10, 'a')
+    token.issue(20, 'b')
+    early = token.snapshot()
+    token.issue(5, 'c')
+    late = token.snapshot()
+    token.restore(early)
+    token.restore(late)
+    assert token.supply == 35 and token.balanceOf('c') == 5
+    token.issue(1, 'd')
+    assert token.balanceOf('d') == 1 and token.account_id('d') == 3
+
+
+def test_issue_many():
+    from auction import Orders
+    orders = Orders()
+    for recipient, value in [('a', 10), ('b', 30), ('a', 20), ('c', 40)]:
+        orders.add(recipient, value)
+    assert len(orders) == 3 and orders.total == 100
+    assert orders.get('a') == 30 and orders.get('d') == 0
+    token = Token()
+    token.issue(5, 'c')
+    assert token.issue_many(orders.shares(1000), orders.recipients) == 1000
+    assert token.supply == 1005
+    assert [token.balanceOf(r) for r in 'abc'] == [300, 300, 405]
+
+    beneficiary = Beneficiary(0.2)
+    mint = Mint(PriceSupplyCurve(factor=0.000001, base_price=1), beneficiary, Auction())
+    mint._issue_many([100, 200, 100], ['x', 'y', 'x'])
+    singly = Mint(PriceSupplyCurve(factor=0.000001, base_price=1), beneficiary, Auction())
+    for num, recipient in [(100, 'x'), (200, 'y'), (100, 'x')]:
+        singly._issue(num, recipient)
+    for holder in ['x', 'y', beneficiary]:
+        xassert(mint.token.balanceOf(holder), singly.token.balanceOf(holder))
+    xassert(mint.token.supply, 400)
+
+
+def test_lazy_claims():
+    import random
+    from auction import Auction as LazyAuction
+
+    def run(lazy_claims):
+        random.seed(1)
+        mint = Mint(PriceSupplyCurve(factor=0.000001, base_price=1), Beneficiary(0.2),
+                    LazyAuction(lazy_claims=lazy_claims))
+        auction = mint.auction
+        auction.start(factor=10**12, const=10**3)
+        while not auction.ended:
+            auction.elapsed += 1000
+            auction.order(random.randint(0, 99), random.randint(1, 10**5))
+        return mint
+
+    eager, lazy = run(False), run(True)
+    assert len(lazy.token._claims) == 1
+    xassert(lazy.token.supply, eager.token.supply)
+    xassert(lazy.token.balanceOf(lazy.beneficiary), eager.token.balanceOf(eager.beneficiary))
+    assert lazy.token.balanceOf(7) == eager.token.balanceOf(7)
+    lazy.token.transfer(3, 'x', lazy.token.balanceOf(3) / 2)
+    lazy.sell(lazy.token.balanceOf(5), 5)
+    eager.token.transfer(3, 'x', eager.token.balanceOf(3) / 2)
+    eager.sell(eager.token.balanceOf(5), 5)
+    assert lazy.token.claim_batch(10) == 10
+    assert lazy.token.balanceOf(lazy.auction.orders.recipients[0]) > 0
+    lazy.token.claim_all()
+    assert not lazy.token._claims
+    for holder in eager.token.accounts:
+        if holder is eager.beneficiary:
+            continue
+        assert lazy.token.balanceOf(holder) == eager.token.balanceOf(holder), holder
+    xassert(lazy.token.supply, sum(lazy.token.accounts.values()))
+    # pending claims do not survive a restore to before the auction
+    token = Token()
+    before = token.snapshot()
+    lazy = run(True)
+    lazy.token.restore(before)
+    assert not lazy.token._claims
+    assert lazy.token.supply == 0 and lazy.token.balanceOf(7) == 0
+
+
+def test_simple_lazy_claims():
+    import random
+    import simple_auction
+
+    def run(lazy_claims):
+        random.seed(1)
+        token = Token()
+        token.issue(0.25 * simple_auction.Auction.supply, 'prealloc')
+        auction = simple_auction.Auction(token, factor=30 * 10**6, const=10**3,
+                                         lazy_claims=lazy_claims)
+        while not auction.closing_price:
+            auction.elapsed += 1000
+            auction.order(random.randint(0, 99), random.randint(1, 10**5))
+        return auction
+
+    eager, lazy = run(False), run(True)
+    assert len(lazy.token._claims) == 1
+    assert lazy.closing_price == eager.closing_price
+    xassert(lazy.token.supply, eager.token.supply)
+    lazy.token.transfer(3, 'x', lazy.token.balanceOf(3) / 2)
+    eager.token.transfer(3, 'x', eager.token.balanceOf(3) / 2)
+    assert lazy.token.claim_batch(10) == 10
+    lazy.token.claim_all()
+    assert not lazy.token._claims
+    balances = dict(lazy.token.accounts.items())
+    assert balances == dict(eager.token.accounts.items())
+    xassert(lazy.token.supply, sum(balances.values()))
+
+
+def test_memoized():
+    from auction import Auction as VersionedAuction
+    mint = Mint(PriceSupplyCurve(factor=0.000001, base_price=1), Beneficiary(0.2),
+                VersionedAuction())
+    auction = mint.auction
+    auction.start(factor=10**12, const=10**3)
+    price = auction.price
+    assert auction.price is price  # cached
+    auction.elapsed += 10
+    assert auction.price < price
+    auction.order('a', 10**5)
+    auction.elapsed = auction.elapsed_at_end()
+    auction.finalize_auction()
+    ask = mint.ask
+    assert mint.ask is ask and mint.bid > 0
+    version = mint.version
+    mint.buy(1000, 'b')
+    assert mint.version != version
+    assert mint.ask > ask
+    mint.token.transfer('b', 'c', 1)
+    assert mint.version != version
+    xassert(mint.valuation, max(0, mint.ask * mint.token.supply - mint.reserve))
+
+
+def test_pickle():
+    import pickle
+    import fixed
+    from auction import Auction as LazyAuction
+    for token in [Token(), fixed.Token()]:
+        for i in range(100):
+            token.issue(i * 10**18 + 1, i)
+        copy = pickle.loads(pickle.dumps(token, pickle.HIGHEST_PROTOCOL))
+        assert type(copy._balances) is type(token._balances)
+        assert copy.supply == token.supply
+        assert dict(copy.accounts.items()) == dict(token.accounts.items())
+        copy.issue(1, 'new')
+        assert copy.account_id('new') == 100 and copy.balanceOf(99) == token.balanceOf(99)
+
+    # an auction with orders and pending claims
+    mint = Mint(PriceSupplyCurve(factor=0.000001, base_price=1), Beneficiary(0.2),
+                LazyAuction(lazy_claims=True))
+    auction = mint.auction
+    auction.start(factor=10**12, const=10**3)
+    for i in range(100):
+        auction.order(i, 10**3 + i)
+    auction.order(3, 10**3)
+    orders = pickle.loads(pickle.dumps(auction.orders, pickle.HIGHEST_PROTOCOL))
+    assert orders.items() == auction.orders.items() and orders.total == auction.orders.total
+    assert orders.get(3) == 2003 and orders.index(99) == 99
+    auction.elapsed = auction.elapsed_at_end()
+    auction.finalize_auction()
+    copy = pickle.loads(pickle.dumps(mint, pickle.HIGHEST_PROTOCOL))
+    assert len(copy.token._claims) == 1
+    assert copy.token.balanceOf(3) == mint.token.balanceOf(3) > 0
+    assert copy.token.balanceOf(copy.beneficiary) == mint.token.balanceOf(mint.beneficiary)
+    assert copy.token.supply == mint.token.supply
+
+
 test_curve()
 test_avg_price()
+test_ledger()
+test_issue_many()
+test_lazy_claims()
+test_memoized()
+test_pickle()
 
 
 def test_auction_sim():
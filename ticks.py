@@ -0,0 +1,163 @@
+"""
+columnar store for simulation ticks
+
+every metric is kept in its own typed array, so a tick costs 8 bytes per metric
+instead of a dict. metrics which are missing in a tick (e.g. Market_Price
+during the auction) are stored as NaN.
+"""
+import sys
+import json
+from array import array
+from collections import OrderedDict
+
+NAN = float('nan')
+MAGIC = 'TICKS1\n'
+
+
+# arrays as raw bytes, pickled arrays would be lists of numbers
+
+def pack_array(a):
+    "(typecode, byteorder, bytes) of the array, see unpack_array"
+    return a.typecode, sys.byteorder, a.tostring()
+
+
+def unpack_array(packed):
+    "the array of pack_array, in the byte order of this machine"
+    typecode, byteorder, data = packed
+    a = array(typecode)
+    a.fromstring(data)
+    return _native(a, byteorder)
+
+
+def _native(a, byteorder):
+    if byteorder != sys.byteorder:
+        a.byteswap()
+    return a
+
+
+class TickStore(object):
+
+    def __init__(self, typecode='d'):
+        self.typecode = typecode
+        self._columns = OrderedDict()
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def __contains__(self, key):
+        return key in self._columns
+
+    def __getitem__(self, key):
+        "the column array itself, not a copy"
+        return self._columns[key]
+
+    def keys(self):
+        return self._columns.keys()
+
+    def append(self, values):
+        n = self._len
+        columns = self._columns
+        for key, value in values.iteritems():
+            column = columns.get(key)
+            if column is None:
+                column = columns[key] = array(self.typecode, [NAN]) * n
+            column.append(value)
+        self._len = n + 1
+        if len(values) < len(columns):
+            for column in columns.itervalues():
+                if len(column) == n:
+                    column.append(NAN)
+
+    def asarray(self, key):
+        "a numpy copy of the column, a view would point to freed memory once the column grows"
+        import numpy
+        return numpy.frombuffer(self._columns[key], dtype=self.typecode).copy()
+
+    def row(self, i):
+        "the tick as dict, missing metrics are left out"
+        return dict((k, c[i]) for k, c in self._columns.iteritems() if c[i] == c[i])
+
+    def rows(self):
+        for i in xrange(self._len):
+            yield self.row(i)
+
+    # pickled as the raw columns
+
+    def __getstate__(self):
+        return dict(typecode=self.typecode, length=self._len,
+                    columns=[(k, pack_array(c)) for k, c in self._columns.iteritems()])
+
+    def __setstate__(self, state):
+        self.typecode = state['typecode']
+        self._columns = OrderedDict((k, unpack_array(c)) for k, c in state['columns'])
+        self._len = state['length']
+
+    # binary columnar file: magic, json header line, raw columns
+
+    def save(self, path):
+        header = dict(length=self._len, typecode=self.typecode, byteorder=sys.byteorder,
+                      columns=self._columns.keys())
+        with open(path, 'wb') as f:
+            f.write(MAGIC)
+            f.write(json.dumps(header) + '\n')
+            for column in self._columns.itervalues():
+                column.tofile(f)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            assert f.readline() == MAGIC, 'not a tick file'
+            header = json.loads(f.readline())
+            store = cls(str(header['typecode']))
+            for key in header['columns']:
+                column = array(store.typecode)
+                column.fromfile(f, header['length'])
+                store._columns[str(key)] = _native(column, header['byteorder'])
+            store._len = header['length']
+        return store
+
+
+def test():
+    import os
+    import tempfile
+    ticks = TickStore()
+    ticks.append(dict(time=0, Price=1.))
+    ticks.append(dict(time=10, Price=2.))
+    ticks.append(dict(time=20, Price=3., Market_Price=2.5))
+    ticks.append(dict(time=30, Market_Price=2.6))
+    assert len(ticks) == 4
+    assert list(ticks['time']) == [0, 10, 20, 30]
+    assert ticks.row(0) == dict(time=0, Price=1.)
+    assert ticks.row(3) == dict(time=30, Market_Price=2.6)
+    assert ticks['Price'][3] != ticks['Price'][3]  # missing
+
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        ticks.save(path)
+        loaded = TickStore.load(path)
+    finally:
+        os.remove(path)
+    assert loaded.keys() == ticks.keys() and len(loaded) == len(ticks)
+    assert list(loaded.rows()) == list(ticks.rows())
+    import pickle
+    loaded = pickle.loads(pickle.dumps(ticks, pickle.HIGHEST_PROTOCOL))
+    assert loaded.keys() == ticks.keys() and list(loaded.rows()) == list(ticks.rows())
+
+    # packed on a machine of the other byte order
+    typecode, byteorder, data = pack_array(ticks['time'])
+    swapped = array(typecode, ticks['time'])
+    swapped.byteswap()
+    other = 'big' if byteorder == 'little' else 'little'
+    assert unpack_array((typecode, other, swapped.tostring())) == ticks['time']
+
+    # asarray stays valid while the column grows and is reallocated
+    prices = loaded.asarray('Price')
+    for i in range(10000):
+        loaded.append(dict(time=40 + i, Price=0.))
+    assert list(prices[:3]) == [1., 2., 3.]
+
+
+if __name__ == '__main__':
+    test()
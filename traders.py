@@ -1,5 +1,6 @@
 from __future__ import division
 from exchange import SellOrder, BuyOrder, Exchange, NotAvailable
+from indicators import SMA, RollingMax
 import random
 
 
@@ -11,7 +12,10 @@ class Trader(object):
         self.cash = cash
         self.tokens = tokens
         self.strategy = strategy
-        self.pending = []  # pending orders
+        self.pending = dict()  # order id -> pending order
+        # cash and tokens locked by pending orders
+        self.reserved_cash = 0
+        self.reserved_tokens = 0
 
     def __repr__(self):
         return '<{} cash:{} tokens:{} strategy:{}'.format(self.__class__.__name__,
@@ -26,13 +30,17 @@ class Trader(object):
             assert isinstance(o, BuyOrder)
             self.cash -= price * amount
             self.tokens += amount
+        # orders of all the cash or tokens leave rounding errors below zero
+        if -1e-6 < self.cash < 0:
+            self.cash = 0
+        if -1e-6 < self.tokens < 0:
+            self.tokens = 0
         assert self.cash >= 0
         assert self.tokens >= 0
-        if o.amount == 0:
-            try:
-                self.pending.remove(o)
-            except ValueError:
-                pass  # FIXME
+        if o.id in self.pending:
+            self._reserve(o, -amount)
+            if o.amount == 0:
+                self._remove(o)
 
     def trigger(self):
         # print self, 'trigger', self.strategy
@@ -40,31 +48,54 @@ class Trader(object):
 
     @property
     def free_cash(self):
-        return self.cash - sum(o.amount * o.price for o in self.pending if isinstance(o, BuyOrder))
+        return self.cash - self.reserved_cash
 
     @property
     def free_tokens(self):
-        return self.tokens - sum(o.amount for o in self.pending if isinstance(o, SellOrder))
+        return self.tokens - self.reserved_tokens
+
+    def _reserve(self, o, amount):
+        if isinstance(o, BuyOrder):
+            self.reserved_cash += amount * o.price
+        else:
+            self.reserved_tokens += amount
+
+    def _remove(self, o):
+        del self.pending[o.id]
+        if not self.pending:  # drop accumulated rounding errors
+            self.reserved_cash = self.reserved_tokens = 0
 
     def place(self, o):
+        # reserve first, the order might be filled while placing it
+        self.pending[o.id] = o
+        self._reserve(o, o.amount)
         self.ex.place(o)
-        self.pending.append(o)
 
     def cancel(self, o):
-        assert o in self.pending
+        assert o.id in self.pending
         try:
             self.ex.cancel(o)
         except:
             print "WARNING, order not at ex", o
-
-        self.pending.remove(o)
+        self._reserve(o, -o.amount)
+        self._remove(o)
 
 
 class StrategyBase(object):
 
+    interval = 10  # polling period, see next_wakeup
+    wake_on_tick = False  # woken by the Scheduler after trades
+
     def __repr__(self):
         return '<{}>'.format(self.__class__.__name__)
 
+    def next_wakeup(self, trader):
+        """
+        the time at which the strategy wants to be triggered next,
+        None to sleep (until the next trade if wake_on_tick)
+        """
+        return trader.ex.time + self.interval
+
     def trigger(self, trader):
         self._trigger(trader)
         # try:
@@ -77,13 +108,12 @@ class StrategyBase(object):
         if price:  # limit order
             amount = cash / price
             o = BuyOrder(price, amount, callback=trader.callback)
-            ex.place(o)
-            trader.pending.append(o)
+            trader.place(o)
         else:  # market order
-            amount, cost = ex.buyable(cash)
-            if amount == 0:
+            amount, unspent = ex.buyable(cash)
+            if amount <= 0:
                 return 0
-            ex.buy_market(amount)
+            cost = ex.buy_market(amount)
             trader.cash -= cost
             trader.tokens += amount
         return amount
@@ -102,14 +132,19 @@ class StrategyBase(object):
 class BuyAndHold(StrategyBase):
     "spends all cash to buy at market or limit"
 
+    wake_on_tick = True
+
     def __init__(self, price_limit=None):
         self.price = price_limit
 
+    def next_wakeup(self, trader):
+        return None
+
     def _trigger(self, trader):
         cash = trader.free_cash
         if cash:
             # self.buy(trader, cash)
-            # print trader.ex._sell_orders
+            # print trader.ex._asks
             price = trader.ex.ask * 0.99
             amount = price / cash
             if amount < 1:
@@ -129,6 +164,14 @@ class AverageIn(StrategyBase):
     def _amount(self, trader):
         return trader.cash / self.steps
 
+    def next_wakeup(self, trader):
+        if not self.intervals:
+            return None
+        start = self.intervals[0][0]
+        if start > trader.ex.time:
+            return start
+        return trader.ex.time + self.interval  # one interval per trigger
+
     def _setup(self, trader):
         amount = self._amount(trader)
         self.intervals = []
@@ -140,9 +183,9 @@ class AverageIn(StrategyBase):
         if self.intervals is None:
             self._setup(trader)
         if self.intervals and self.intervals[0][0] <= trader.ex.time:
+            price = trader.ex.ask * 0.99  # before the pop, NotAvailable keeps the slice
             start, cash = self.intervals.pop(0)
             # self.buy(trader, cash)  # market order
-            price = trader.ex.ask * 0.99
             amount = price / cash
             o = BuyOrder(price, amount, callback=trader.callback)
             trader.place(o)
@@ -158,23 +201,29 @@ class AverageOut(AverageIn):
         if self.intervals is None:
             self._setup(trader)
         if self.intervals and self.intervals[0][0] <= trader.ex.time:
+            price = trader.ex.bid * 1.01  # before the pop, NotAvailable keeps the slice
             start, amount = self.intervals.pop(0)
             # self.sell(trader, min(amount, trader.tokens))  # market order
-            price = trader.ex.bid * 1.01
             o = SellOrder(price, amount, callback=trader.callback)
             trader.place(o)
 
 
 class TrailingStop(StrategyBase):
-    "sells all tokens if price drops below a fraction of the max price seen"
+    """
+    sells all tokens if price drops below a fraction of the max price seen
+    with a window, the max is taken over the trade prices within the window
+    """
 
-    def __init__(self, max_loss_fraction=0.3):
+    def __init__(self, max_loss_fraction=0.3, window=None):
         self.max_price = 0
         self.max_loss_fraction = max_loss_fraction
+        self.window = window
 
     def _trigger(self, trader):
         try:
             price = trader.ex.bid
+            if self.window:
+                self.max_price = trader.ex.indicator(RollingMax, self.window).value(trader.ex.time)
         except NotAvailable:
             return
         self.max_price = max(self.max_price, price)
@@ -189,11 +238,7 @@ class TrendFollower(StrategyBase):
         self.period = period
 
     def _ma(self, ex):  # simple moving average
-        oldest = ex.time - self.period
-        prices = [t.price for t in ex.ticker if t.time > oldest]
-        if not prices:
-            raise NotAvailable()
-        return sum(prices) / len(prices)
+        return ex.indicator(SMA, self.period).value(ex.time)
 
     def _trigger(self, trader):
         try:
@@ -219,7 +264,7 @@ class MarketMaker(StrategyBase):
         self.sigma = sigma
 
     def _trigger(self, trader):
-        for o in list(trader.pending):  # delete old orders
+        for o in trader.pending.values():  # delete old orders
             trader.cancel(o)
         self.price *= random.normalvariate(self.mu, self.sigma)
         ask = self.price * 1.01
@@ -234,10 +279,82 @@ class Arbitrageur(StrategyBase):
     """
     bridges ContinousToken and Exchange by selling/buying at market prices
     should not hold any tokens and have plenty of cash
+
+    buys from the mint and sells into the bids while the bids are above the
+    marginal mint price, or buys the asks below the mint bid and sells them
+    to the mint. the profit maximizing amount is solved in one step against
+    the cumulative depth of the book, see Exchange.sell_depth.
+    custody: the ledger account of the mint token holding the tokens traded on
+    the exchange, tokens sold there move to it, bought ones out of it.
+    without custody the tokens are only bought from the mint.
     """
 
+    wake_on_tick = True
+
+    def __init__(self, mint, custody=None):
+        self.mint = mint
+        self.custody = custody
+
+    def _mint_amount(self, price):
+        "tokens bought from the mint until its marginal price reaches price"
+        mint = self.mint
+        factor = mint.beneficiary.factor
+        if price / factor <= mint.curve.b:
+            return 0
+        value = mint.curve.reserve_at_price(price / factor) - mint.reserve
+        if value <= mint.reserve * 1e-12:  # within the rounding of a buy up to price
+            return 0
+        return mint._issued_for(value)
+
+    def _trigger(self, trader):
+        if self.mint.isauction:
+            return
+        if not self._buy_from_mint(trader):
+            self._sell_to_mint(trader)
+
+    def _buy_from_mint(self, trader):
+        mint, ex = self.mint, trader.ex
+        amount = ex.sell_depth(self._mint_amount)
+        if amount <= 0:
+            return 0
+        value = mint._value_to_buy(amount)
+        if value > trader.free_cash:  # all cash, fewer tokens
+            value = trader.free_cash
+        if value <= 0:
+            return 0
+        tokens = mint.buy(value, trader)
+        trader.cash -= value
+        trader.tokens += tokens
+        # every issued token is sold, tokens differ from amount by rounding only
+        if self.custody is not None:
+            mint.token.transfer(trader, self.custody, tokens)
+        return self.sell(trader, tokens)
+
+    def _sell_to_mint(self, trader):
+        mint, ex = self.mint, trader.ex
+        if self.custody is None:
+            return 0
+        bid = mint.bid
+        # the mint bid does not change with sales, buy every ask below it
+        amount = ex.buy_depth(lambda price: float('inf') if price < bid else 0)
+        # custody can hold more than the supply, Mint._issue credits the seigniorage negative
+        amount = min(amount, mint.token.balanceOf(self.custody), mint.token.supply)
+        if amount <= 0:
+            return 0
+        affordable, unspent = ex.buyable(trader.free_cash)
+        amount = min(amount, affordable)
+        cost = ex.buy_market(amount)
+        trader.cash -= cost
+        trader.tokens += amount
+        mint.token.transfer(self.custody, trader, amount)
+        value = mint.sell(amount, trader)
+        trader.cash += value
+        trader.tokens -= amount
+        return value
+
 
 def test():
+    from scheduler import Scheduler
     random.seed(42)
 
     exchange = Exchange()
@@ -271,19 +388,110 @@ def test():
     exchange.time = 1
     end_time = 3600
     interval = 10
-    while exchange.time < end_time:
-        exchange.time += interval
-        for t in traders:
-            t.trigger()
+    scheduler = Scheduler(exchange, quantum=interval)  # wakes traders on the polling grid
+    for t in traders:
+        scheduler.add(t, exchange.time + interval)
+    scheduler.run(end_time + 1)
 
     print '\n'.join([str(x) for x in exchange.ticker])
-    print exchange._sell_orders
-    print exchange._buy_orders
+    print exchange._asks
+    print exchange._bids
 
     print traders
 
     total_tokens2 = sum([t.tokens for t in traders])
-    assert total_tokens2 == total_tokens, (total_tokens2, total_tokens)
+    assert abs(total_tokens2 - total_tokens) < 1e-6, (total_tokens2, total_tokens)
+
+
+def test_reservations():
+    ex = Exchange()
+    buyer = Trader(ex, cash=1000, tokens=0)
+    seller = Trader(ex, cash=0, tokens=100)
+
+    o = BuyOrder(10, 50, callback=buyer.callback)
+    buyer.place(o)
+    assert buyer.free_cash == 500 and o.id in buyer.pending
+
+    # partial fill at the order price
+    seller.place(SellOrder(10, 20, callback=seller.callback))
+    assert buyer.tokens == 20 and buyer.cash == 800
+    assert buyer.free_cash == 500
+    assert seller.free_tokens == 80 and not seller.pending
+
+    buyer.cancel(o)
+    assert buyer.free_cash == buyer.cash == 800 and not buyer.pending
+
+    # filled while placing, never stays pending
+    s = SellOrder(12, 30, callback=seller.callback)
+    seller.place(s)
+    assert seller.free_tokens == 50
+    buyer.place(BuyOrder(12, 30, callback=buyer.callback))
+    assert not buyer.pending and not seller.pending
+    assert buyer.free_cash == buyer.cash and seller.free_tokens == seller.tokens == 50
+
+
+def test_arbitrageur():
+    import simulator
+
+    def setup():
+        mint = simulator.gen_token()
+        mint.auction.start(factor=10**7, const=10**3)
+        mint.auction.order('prealloc', mint.auction.missing_reserve_to_end_auction)
+        return mint, Exchange()
+
+    def no_arbitrage(mint, ex, tolerance=1e-6):
+        "the next token does not pay off on either side"
+        amount, proceeds = ex.sellable(0.001)
+        assert proceeds <= mint._sale_cost(amount) * (1 + tolerance)
+        amount, cost = ex._asks.quote_amount(0.001)
+        assert cost >= mint._purchase_cost(amount) * (1 - tolerance)
+
+    # bids above the mint ask, the solve stops inside the last level
+    mint, ex = setup()
+    maker = Trader(ex, cash=10**6)
+    ask = mint.ask
+    for f, amount in [(1.2, 10), (1.1, 100), (1.05, 1000), (1.01, 10**5)]:
+        maker.place(BuyOrder(ask * f, amount, callback=maker.callback))
+    arb = Trader(ex, cash=10**5, strategy=Arbitrageur(mint, 'prealloc'))
+    arb.trigger()
+    assert arb.cash > 10**5 and ex._bids
+    assert abs(arb.tokens) < 1e-6 and abs(mint.token.balanceOf(arb)) < 1e-6
+    no_arbitrage(mint, ex)
+    assert abs(ex.bid - mint.ask) < mint.ask * 1e-5
+    arb.trigger()  # nothing left
+    assert len(ex.ticker) == 4
+
+    # asks below the mint bid, bought and sold to the mint
+    mint, ex = setup()
+    maker = Trader(ex, tokens=5000)
+    bid = mint.bid
+    for f, amount in [(0.8, 10), (0.9, 100), (0.95, 1000), (1.1, 1000)]:
+        maker.place(SellOrder(bid * f, amount, callback=maker.callback))
+    arb = Trader(ex, cash=10**5, strategy=Arbitrageur(mint, 'prealloc'))
+    arb.trigger()
+    assert arb.cash > 10**5 and arb.tokens == 0
+    assert ex.ask == bid * 1.1 and mint.bid == bid
+    assert abs(mint.token.balanceOf('prealloc') - (12500 - 1110)) < 1e-6
+
+    # coupled, one solve per tick keeps the book around the mint
+    random.seed(42)
+    mint, ex = setup()
+    mms = MarketMaker(start_price=mint.ask * 1.1, mu=1, sigma=0.02)
+    market_maker = Trader(ex, 10**7, 5000, mms)  # bids are never taken completely
+    arb = Trader(ex, cash=10**6, strategy=Arbitrageur(mint, 'prealloc'))
+    ex.time = 1
+    while ex.time < 3600:
+        ex.time += 10
+        market_maker.trigger()
+        arb.trigger()
+        no_arbitrage(mint, ex)
+        # every token bought from the mint is sold, the ledger agrees
+        assert abs(arb.tokens) < 1e-6, arb.tokens
+        assert abs(mint.token.balanceOf(arb) - arb.tokens) < 1e-6
+    assert arb.cash > 10**6
+
 
 if __name__ == '__main__':
+    test_reservations()
+    test_arbitrageur()
     test()
@@ -0,0 +1,107 @@
+"""
+array versions of the PriceSupplyCurve functions
+
+curve parameters and inputs broadcast against each other, e.g.
+    curves = PriceSupplyCurves(factor=[[0.0001], [0.001]], base_price=1)
+    curves.supply(numpy.linspace(0, 10**6, 1000))
+evaluates two curves over 1000 reserves in one call and returns a (2, 1000) array
+"""
+from __future__ import division
+import numpy as np
+
+
+class PriceSupplyCurves(object):
+
+    def __init__(self, factor=1., base_price=0):
+        self.f = np.asarray(factor, dtype=float)
+        self.b = np.asarray(base_price, dtype=float)
+
+    @classmethod
+    def from_curves(cls, curves):
+        "a family of the given ctoken.PriceSupplyCurve instances"
+        return cls(factor=[c.f for c in curves], base_price=[c.b for c in curves])
+
+    def price(self, supply):
+        return self.b + self.f * np.asarray(supply)
+
+    def price_at_reserve(self, reserve):
+        return self.price(self.supply(reserve))
+
+    def supply(self, reserve):
+        return (-self.b + np.sqrt(self.b**2 + 2 * self.f * np.asarray(reserve))) / self.f
+
+    def supply_at_price(self, price):
+        return (np.asarray(price) - self.b) / self.f
+
+    def reserve(self, supply):
+        supply = np.asarray(supply)
+        return self.b * supply + self.f / 2 * supply**2
+
+    def reserve_at_price(self, price):
+        return self.reserve(self.supply_at_price(price))
+
+    def avg_price_at_reserve(self, reserve):
+        return reserve / self.supply(reserve)
+
+    def supply_at_avg_price(self, avg_price):
+        return (np.asarray(avg_price) - self.b) / self.f * 2
+
+    def supply_at_avg_price_and_existing_supply(self, avg_price, s1):
+        return (np.asarray(avg_price) - self.b - self.f / 2 * np.asarray(s1)) / self.f * 2
+
+    def avg_price_at_supply(self, supply):
+        return self.b + self.f / 2 * np.asarray(supply)
+
+    def reserve_at_avg_price(self, avg_price):
+        return self.reserve(self.supply_at_avg_price(avg_price))
+
+    def cost(self, supply, num):
+        supply = np.asarray(supply)
+        return self.reserve(supply + num) - self.reserve(supply)
+
+    def issued(self, supply, added_reserve):
+        reserve = self.reserve(supply)
+        return self.supply(reserve + added_reserve) - self.supply(reserve)
+
+    def mktcap(self, supply):
+        return self.price(supply) * supply
+
+    def supply_at_mktcap(self, m, skipped=0):
+        f = self.f
+        b = self.b + np.asarray(skipped) * self.f
+        return (-b + np.sqrt(b**2 + 4 * f * np.asarray(m))) / (2 * f)
+
+
+def test():
+    from ctoken import PriceSupplyCurve, xassert
+    scalars = [PriceSupplyCurve(factor=f, base_price=b)
+               for f, b in [(0.0001, 5), (0.000001, 1), (1., 0)]]
+    curves = PriceSupplyCurves.from_curves(scalars)
+    # one curve per row, inputs along the columns
+    curves = PriceSupplyCurves(curves.f[:, None], curves.b[:, None])
+    values = np.array([0., 1., 1000., 10**6])
+    for name, args in [('price', (values,)),
+                       ('supply', (values,)),
+                       ('reserve', (values,)),
+                       ('price_at_reserve', (values,)),
+                       ('supply_at_price', (values + 5,)),
+                       ('reserve_at_price', (values + 5,)),
+                       ('avg_price_at_supply', (values,)),
+                       ('cost', (values, 100)),
+                       ('issued', (values, 100)),
+                       ('mktcap', (values,)),
+                       ('supply_at_mktcap', (values,))]:
+        result = getattr(curves, name)(*args)
+        assert result.shape == (len(scalars), len(values)), (name, result.shape)
+        for i, c in enumerate(scalars):
+            for j in range(len(values)):
+                expected = getattr(c, name)(*[np.asarray(a).flat[j] if np.ndim(a) else a
+                                              for a in args])
+                xassert(result[i, j], expected)
+    # broadcasting over a parameter alone
+    prices = PriceSupplyCurves(factor=[0.1, 0.2, 0.4], base_price=1).price(10)
+    assert list(prices) == [2, 3, 5]
+
+
+if __name__ == '__main__':
+    test()